@@ -0,0 +1,109 @@
+import contextlib
+import glob
+import io
+import re
+import sys
+import time
+import tracemalloc
+from geoparser import Datastore, Document, Layer
+from geoparser.gazetteer import NameIndex
+from geoparser.matcher import NameMatcher, AutomatonMatcher
+
+# usage: python3 benchmark-matcher.py [--engine names|automaton] [--anchor <geoname id> | --phrases] [--documents <count>]
+#                                   [--compare <gazetteers>]
+# matches the GeoWebNews corpus against its annotated toponyms, all of its capitalized phrases or the OSM names
+# around an anchor, and reports the time and the peak memory allocated while matching. --compare splits the names
+# into overlapping gazetteers and checks that a single pass over all of them matches like one pass per gazetteer
+
+args = sys.argv[1:]
+engine = args[args.index('--engine') + 1] if '--engine' in args else 'names'
+doc_count = int(args[args.index('--documents') + 1]) if '--documents' in args else None
+
+corpus_dir = 'evaluation/corpora/GeoWebNews'
+text_paths = sorted(glob.glob(f'{corpus_dir}/*.txt'), key=lambda p: int(p.split('/')[-1][:-4]))
+texts = []
+for path in text_paths[:doc_count]:
+  with open(path, 'r') as f:
+    texts.append(f.read())
+
+if '--anchor' in args:
+  anchor = Datastore.get_geoname(int(args[args.index('--anchor') + 1]))
+  gazetteer = Datastore.load_osm_database(anchor)
+elif '--phrases' in args:
+  names = {}
+  for path in text_paths:
+    with open(path, 'r') as f:
+      for m in re.finditer("[A-Z][\\w'.-]*(?: [A-Z][\\w'.-]*){0,3}", f.read()):
+        names[m.group(0)] = True
+  gazetteer = NameIndex(list(names))
+else:
+  names = {}
+  for path in text_paths:
+    with open(path.replace('.txt', '.ann'), 'r') as f:
+      for line in f:
+        cols = line.rstrip('\n').split('\t')
+        if line.startswith('T') and len(cols) == 3:
+          names[cols[2]] = True
+  gazetteer = NameIndex(list(names))
+
+matcher = AutomatonMatcher() if engine == 'automaton' else NameMatcher()
+print(f'{len(texts)} documents, {len(gazetteer.names)} names, {engine} engine')
+
+def annotate_all(gazetteers, single_pass):
+  layers = []
+  for text in texts:
+    doc = Document(text)
+    def committer(source):
+      def commit(c):
+        doc.annotate(Layer.lres, c.pos, c.match, 'local', source, replace_shorter=True)
+        return True
+      return commit
+    commits = [committer(i) for i in range(len(gazetteers))]
+    with contextlib.redirect_stdout(io.StringIO()):
+      if single_pass:
+        matcher.find_merged_matches(doc, gazetteers, commits)
+      else:
+        for gazetteer, commit in zip(gazetteers, commits):
+          matcher.find_matches(doc, gazetteer, commit)
+    layers.append(doc.export_layers())
+  return layers
+
+if '--compare' in args:
+  count = int(args[args.index('--compare') + 1])
+  step = len(gazetteer.names) // (count + 1)
+  gazetteers = [NameIndex(gazetteer.names[i * step:(i + 2) * step]) for i in range(count)]
+  sequential = annotate_all(gazetteers, False)
+  merged = annotate_all(gazetteers, True)
+  differing = [i for i in range(len(texts)) if sequential[i] != merged[i]]
+  print(f'{len(texts) - len(differing)}/{len(texts)} documents match equally in a single pass over {count} gazetteers')
+  if len(differing) > 0:
+    print('differing: ' + ', '.join(text_paths[i] for i in differing))
+    sys.exit(1)
+  sys.exit(0)
+
+def match_all():
+  count = 0
+  peaks = []
+  for text in texts:
+    doc = Document(text)
+    matches = []
+    tracemalloc.reset_peak()
+    current = tracemalloc.get_traced_memory()[0]
+    matcher.find_matches(doc, gazetteer, lambda c: matches.append(c.match) or True)
+    peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    count += len(matches)
+  return count, peaks
+
+match_all() # warm up caches
+
+start_time = time.time()
+count, _ = match_all()
+elapsed = time.time() - start_time
+
+tracemalloc.start()
+_, peaks = match_all()
+tracemalloc.stop()
+
+print(f'{count} matches in {elapsed:.2f}s')
+print(f'memory allocated while matching a document: {sum(peaks) / len(peaks) / 1e3:.0f}KB on average, ' +
+      f'{max(peaks) / 1e3:.0f}KB at most')
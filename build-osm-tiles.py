@@ -0,0 +1,10 @@
+import sys
+from geoparser import OSMExtractImporter
+
+# usage: python3 build-osm-tiles.py <extract.osm[.bz2]|extract.osm.pbf> [--overwrite]
+
+extract_path = sys.argv[1]
+overwrite = '--overwrite' in sys.argv[2:]
+
+importer = OSMExtractImporter(overwrite=overwrite)
+importer.import_file(extract_path)
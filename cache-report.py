@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+from geoparser import Datastore, GeoUtil
+
+# usage: python3 cache-report.py [--limit <rows>] [--evict <quota in MB>] [--remove-legacy]
+# shows the cache size per anchor and their hits, optionally evicts the least recently used OSM tiles
+# and removes the per-anchor OSM databases of older versions
+
+args = sys.argv[1:]
+limit = int(args[args.index('--limit') + 1]) if '--limit' in args else 20
+
+if '--remove-legacy' in args:
+  Datastore.remove_legacy_osm_databases()
+
+if '--evict' in args:
+  quota = float(args[args.index('--evict') + 1]) * 1e6
+  Datastore.enforce_cache_quota(quota)
+
+Datastore.flush_usage()
+db = Datastore._usage_db()
+
+file_sizes = {e.name: e.stat().st_size for e in os.scandir(Datastore.cache_dir) if e.is_file()}
+tile_sizes = {t: file_sizes[os.path.basename(Datastore._osm_tile_path(t))] for t in Datastore.cached_osm_tiles()}
+tile_total = sum(tile_sizes.values())
+total = sum(file_sizes.values())
+print(f'cache: {total / 1e6:.1f}MB in {len(file_sizes)} files, ' +
+      f'{tile_total / 1e6:.1f}MB in {len(tile_sizes)} OSM tiles')
+for name in ['geonames', 'geometries', 'usage']:
+  size = sum(s for f, s in file_sizes.items() if f.startswith(name + '.db'))
+  print(f'{name}: {size / 1e6:.1f}MB')
+
+def age(timestamp):
+  hours = (time.time() - timestamp) / 3600
+  return f'{hours:.0f}h' if hours < 48 else f'{hours / 24:.0f}d'
+
+print(f'\nanchors by hits (top {limit}):')
+for (geoname_id, name, lat, lon, hits, last_access) in db.get_anchors()[:limit]:
+  bbox = GeoUtil.bounding_box(lat, lon, Datastore.osm_search_dist)
+  tiles = Datastore._osm_tiles(bbox)
+  size = sum(tile_sizes.get(t, 0) for t in tiles)
+  cached = len([t for t in tiles if t in tile_sizes])
+  print(f'{name} [{geoname_id}]: {hits} hits, last {age(last_access)} ago, ' +
+        f'{size / 1e6:.1f}MB in {cached}/{len(tiles)} tiles')
+
+tile_usage = db.get_tiles()
+print(f'\nOSM tiles by size (top {limit}):')
+for tile, size in sorted(tile_sizes.items(), key=lambda i: -i[1])[:limit]:
+  (hits, last_access) = tile_usage.get(tile, (0, None))
+  last = 'never used' if last_access == None else f'last {age(last_access)} ago'
+  print(f'{tile}: {size / 1e6:.1f}MB, {hits} hits, {last}')
@@ -190,7 +190,7 @@ class ResolEvaluator(Evaluator):
       dist = GeoUtil.distance(a.data[0], a.data[1], gold_lat, gold_lon)
       resolved = dist < tolerance
       if not resolved and a.group == 'local':
-        boxes = self._bounding_boxes(a.data[2])
+        boxes = self._bounding_boxes(a.data[2], gold_lat, gold_lon)
         for bbox in boxes:
           if GeoUtil.point_in_bounding_box(gold_lat, gold_lon, bbox):
             resolved = True
@@ -206,7 +206,7 @@ class ResolEvaluator(Evaluator):
     self._print_if_not_empty(incorrects, 'RES INCORRECT')
     self._print_if_not_empty(missed, 'RES MISSED')
 
-  def _bounding_boxes(self, osm_refs):
+  def _bounding_boxes(self, osm_refs, lat, lon):
     ways_and_rels = []
     for ref in osm_refs:
       if ref.startswith('node'):
@@ -215,7 +215,11 @@ class ResolEvaluator(Evaluator):
       type_id = OSMElement.type_names.index(parts[0])
       element = OSMElement(type_id, int(parts[1]))
       ways_and_rels.append(element)
-    geoms = Datastore.load_osm_geometries(ways_and_rels)
+    # cached tiles around the gold coordinate first, so that evaluation works
+    # offline, remaining elements from the geometry cache and Overpass
+    bbox = GeoUtil.bounding_box(lat, lon, Datastore.osm_search_dist)
+    osm_db = Datastore.cached_osm_database(bbox)
+    geoms = Datastore.load_osm_geometries(ways_and_rels, [osm_db])
     boxes = [BoundingBox(*geom) for geom in geoms['way'].values()]
     boxes += [BoundingBox(*geom) for geom in geoms['relation'].values()]
     return boxes
@@ -3,6 +3,9 @@ from .datastore import Datastore
 from .pipeline import Step, Pipeline, PipelineBuilder
 from .ner import NERException
 from .reclassifier import Reclassifier, ReclassificationFeatureExtractor
-from .geonames import GeoNamesAPI, GeoName
-from .osm import OverpassAPI, OSMElement
+from .geonames import GeoNamesAPI, GeoName, GeoNamesException
+from .geonamesdump import GeoNamesDumpImporter
+from .osm import OverpassAPI, OSMElement, OverpassException
+from .osmextract import OSMExtractImporter
+from .warmup import CacheWarmer
 from .util import BoundingBox, GeoUtil
\ No newline at end of file
@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+try:
+  import fcntl
+except ImportError:
+  fcntl = None # no cross-process locking on Windows
+
+
+class LRUCache:
+
+  def __init__(self, name, max_size, weight=None):
+    self.name = name
+    self.max_size = max_size
+    self.weight = weight # size of an entry, 1 if None
+    self.entries = OrderedDict()
+    self.size = 0
+    self.lock = threading.Lock()
+    self._reset_counters()
+
+  def _reset_counters(self):
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+  def _weigh(self, value):
+    return 1 if self.weight == None else self.weight(value)
+
+  def get(self, key):
+    with self.lock:
+      if key not in self.entries:
+        self.misses += 1
+        return None
+      self.hits += 1
+      self.entries.move_to_end(key)
+      return self.entries[key]
+
+  def put(self, key, value):
+    with self.lock:
+      if key in self.entries:
+        self.size -= self._weigh(self.entries[key])
+      self.entries[key] = value
+      self.size += self._weigh(value)
+      self.entries.move_to_end(key)
+      while self.size > self.max_size and len(self.entries) > 1:
+        (_, evicted) = self.entries.popitem(last=False)
+        self.size -= self._weigh(evicted)
+        self.evictions += 1
+
+  def remove_where(self, predicate):
+    # predicate(key, value), returns the removed values
+    with self.lock:
+      keys = [k for k, v in self.entries.items() if predicate(k, v)]
+      removed = [self.entries.pop(k) for k in keys]
+      self.size -= sum(self._weigh(v) for v in removed)
+      return removed
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.size = 0
+      self._reset_counters()
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    hit_rate = self.hits / lookups if lookups > 0 else 0.0
+    return {'size': self.size, 'entries': len(self.entries), 'max_size': self.max_size, 'hits': self.hits,
+            'misses': self.misses, 'evictions': self.evictions, 'hit_rate': hit_rate}
+
+
+class NegativeCache:
+
+  purge_size = 10000
+
+  def __init__(self, ttls):
+    self.ttls = ttls # endpoint: seconds
+    self.expiry = {}
+    self.lock = threading.Lock()
+
+  def add(self, endpoint, key):
+    now = time.time()
+    with self.lock:
+      if len(self.expiry) >= self.purge_size:
+        self.expiry = {k: t for k, t in self.expiry.items() if t > now}
+      self.expiry[(endpoint, key)] = now + self.ttls.get(endpoint, 0)
+
+  def contains(self, endpoint, key):
+    with self.lock:
+      expiry = self.expiry.get((endpoint, key))
+      if expiry == None:
+        return False
+      if expiry < time.time():
+        del self.expiry[(endpoint, key)]
+        return False
+      return True
+
+  def clear(self):
+    with self.lock:
+      self.expiry.clear()
+
+
+class SingleFlight:
+
+  def __init__(self):
+    self.calls = {} # key: call state shared with waiting threads
+    self.lock = threading.Lock()
+
+  def do(self, key, function):
+    with self.lock:
+      call = self.calls.get(key)
+      is_leader = call == None
+      if is_leader:
+        call = {'done': threading.Event(), 'result': None, 'error': None}
+        self.calls[key] = call
+
+    if not is_leader:
+      call['done'].wait()
+      if call['error'] != None:
+        raise call['error']
+      return call['result']
+
+    try:
+      call['result'] = function()
+      return call['result']
+    except Exception as e:
+      call['error'] = e
+      raise
+    finally:
+      with self.lock:
+        del self.calls[key]
+      call['done'].set()
+
+
+class FileLock:
+
+  def __init__(self, path):
+    self.path = path
+    self.file = None
+
+  def __enter__(self):
+    while True:
+      self.file = open(self.path, 'a')
+      if fcntl == None:
+        return self
+      fcntl.flock(self.file, fcntl.LOCK_EX)
+      # the lock file might have been removed while waiting (e.g. by an eviction)
+      try:
+        if os.stat(self.path).st_ino == os.fstat(self.file.fileno()).st_ino:
+          return self
+      except FileNotFoundError:
+        pass
+      fcntl.flock(self.file, fcntl.LOCK_UN)
+      self.file.close()
+
+  def __exit__(self, *args):
+    if fcntl != None:
+      fcntl.flock(self.file, fcntl.LOCK_UN)
+    self.file.close()
+    self.file = None
@@ -1,11 +1,120 @@
 import os
+import re
 import csv
 import json
+import atexit
 import sqlite3
 import pickle
-from .util import GeoUtil
-from .geonames import GeoName, GeoNamesAPI
-from .osm import OSMElement, OverpassAPI
+import time
+import math
+import pathlib
+import threading
+from contextlib import ExitStack
+from .util import BoundingBox, GeoUtil
+from .geonames import GeoName, GeoNamesAPI, GeoNamesException
+from .osm import OSMElement, OverpassAPI, OverpassException
+from .gazetteer import Gazetteer, NameIndex
+from .cache import LRUCache, NegativeCache, SingleFlight, FileLock
+
+
+class GeoNamesWriteBuffer:
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.condition = threading.Condition(self.lock)
+    self.due = None # time of the scheduled flush
+    self.flusher = None
+    self._reset()
+    # entries being written stay readable until the write is finished
+    self.flushing_geonames = {}
+    self.flushing_children = {}
+
+  def _reset(self):
+    self.geonames = {}
+    self.searches = {}
+    self.hierarchies = {}
+    self.children = {}
+
+  def add_geonames(self, geonames):
+    with self.lock:
+      for g in geonames:
+        self.geonames[g.id] = g
+
+  def add_search(self, name, results):
+    with self.lock:
+      self.searches[name] = results
+    self.add_geonames(results)
+
+  def add_hierarchy(self, geoname_id, hierarchy):
+    with self.lock:
+      self.hierarchies[geoname_id] = hierarchy
+    self.add_geonames(hierarchy)
+
+  def add_children(self, geoname_id, children):
+    with self.lock:
+      self.children[geoname_id] = children
+    self.add_geonames(children)
+
+  def get_geoname(self, geoname_id):
+    with self.lock:
+      if geoname_id in self.geonames:
+        return self.geonames[geoname_id]
+      return self.flushing_geonames.get(geoname_id)
+
+  def get_children(self, geoname_id):
+    with self.lock:
+      if geoname_id in self.children:
+        return self.children[geoname_id]
+      return self.flushing_children.get(geoname_id)
+
+  def size(self):
+    return len(self.geonames)
+
+  def schedule(self, interval, callback):
+    with self.lock:
+      if self.due != None:
+        return
+      self.due = time.time() + interval
+      if self.flusher == None:
+        # one long-lived thread, so it keeps its GeoNames connection between flushes
+        self.flusher = threading.Thread(target=self._run_flusher, args=(callback, ), daemon=True)
+        self.flusher.start()
+      self.condition.notify()
+
+  def _run_flusher(self, callback):
+    while True:
+      with self.lock:
+        while self.flusher != None and (self.due == None or self.due > time.time()):
+          self.condition.wait(None if self.due == None else self.due - time.time())
+        if self.flusher == None:
+          return
+      callback()
+
+  def stop(self):
+    # ends the thread at exit, so that its connection is closed in that thread
+    with self.lock:
+      flusher = self.flusher
+      self.flusher = None
+      self.condition.notify()
+    if flusher != None:
+      flusher.join()
+
+  def take(self):
+    with self.lock:
+      self.due = None
+      parts = [self.geonames, self.searches, self.hierarchies, self.children]
+      if not any(parts):
+        return None
+      self.flushing_geonames = self.geonames
+      self.flushing_children = self.children
+      batch = (list(self.geonames.values()), self.searches, self.hierarchies, self.children)
+      self._reset()
+    return batch
+
+  def finish(self):
+    with self.lock:
+      self.flushing_geonames = {}
+      self.flushing_children = {}
 
 
 class Datastore:
@@ -15,127 +124,593 @@ class Datastore:
   osm_search_dist = 15 # km
   osm_exclusions = ['shop', 'power', 'office', 'cuisine']
   osm_name_min_length = 4
+  osm_tile_size = 0.1 # degrees
+  osm_name_index = True
+  osm_offline = False # only use the cached tiles (e.g. built from an extract), never request Overpass
+
+  sqlite_pragmas = ['journal_mode = WAL', 'synchronous = NORMAL',
+                    'mmap_size = 268435456', 'cache_size = -65536'] # 256MB, 64MB
+
+  geonames_flush_interval = 5 # seconds
+  geonames_flush_size = 1000 # geonames
+  osm_load_workers = 4
+  cache_quota = None # bytes, None for unlimited
+  usage_flush_interval = 60 # seconds
+
+  # seconds until failed or empty results are requested again
+  negative_ttls = {'get': 3600, 'search': 6 * 3600, 'hierarchy': 6 * 3600,
+                   'children': 6 * 3600, 'overpass': 900, 'geometries': 900}
+  # seconds until cached results are refreshed, None for never
+  positive_ttls = {'search': 180 * 86400, 'hierarchy': None, 'children': None,
+                   'overpass': 180 * 86400}
 
-  geonames = {}
-  hierarchies = {}
-  search_results = {}
+  geonames = LRUCache('geonames', 100000)
+  hierarchies = LRUCache('hierarchies', 20000)
+  search_results = LRUCache('search_results', 20000)
+  children = LRUCache('children', 5000)
+  osm_databases = LRUCache('osm_databases', 20) # anchors, partial tile sets by their tiles
+  completions = LRUCache('completions', 200000, lambda t: max(len(t), 1)) # (gazetteer, prefix), sized by templates
+  connections = threading.local()
+  pending = GeoNamesWriteBuffer()
+  failures = NegativeCache(negative_ttls)
+  requests = SingleFlight()
+  setup_lock = threading.Lock() # database creation and migration
+  flush_lock = threading.Lock()
+  osm_tile_loads = {} # tile: threading.Event
+  anchor_usage = {} # geoname_id: [name, lat, lon, hits, last access]
+  tile_usage = {} # tile: [hits, last access]
+  usage_flushed = time.time()
+  usage_lock = threading.Lock()
+  osm_tile_lock = threading.Lock()
 
   @staticmethod
   def get_geoname(geoname_id):
-    if geoname_id in Datastore.geonames:
-      return Datastore.geonames[geoname_id]
-    db = Datastore._geonames_db()
-    geoname = db.get_geoname(geoname_id)
+    geoname = Datastore.geonames.get(geoname_id)
+    if geoname != None:
+      return geoname
+    geoname = Datastore.pending.get_geoname(geoname_id)
+    if geoname == None:
+      db = Datastore._geonames_db()
+      geoname = db.get_geoname(geoname_id)
     if geoname == None:
-      geoname = GeoNamesAPI.get_geoname(geoname_id)
-      db.store_geoname(geoname)
-    Datastore.geonames[geoname_id] = geoname
+      geoname = Datastore._request('get', geoname_id, lambda: GeoNamesAPI.get_geoname(geoname_id))
+      if geoname == None:
+        raise GeoNamesException(f'GeoName {geoname_id} unavailable')
+      Datastore.pending.add_geonames([geoname])
+      Datastore._schedule_flush()
+    Datastore.geonames.put(geoname_id, geoname)
     return geoname
 
   @staticmethod
   def search_geonames(name):
-    if name in Datastore.search_results:
-      return Datastore.search_results[name]
+    results = Datastore.search_results.get(name)
+    if results != None:
+      return results
     db = Datastore._geonames_db()
-    results = db.get_search(name)
+    results = db.get_search(name, *Datastore._ttls('search'))
+    if results == None and db.has_dump():
+      results = db.get_dump_search(name, Datastore.geonames_search_classes)
     if results == None:
       classes = Datastore.geonames_search_classes
-      results = GeoNamesAPI.search(name, classes)
+      results = Datastore._request('search', name, lambda: GeoNamesAPI.search(name, classes))
+      if results == None:
+        return []
       results = [g for g in results if g.id != 6295630] # remove Earth
-      db.store_search(name, results)
-    Datastore.search_results[name] = results
+      Datastore.pending.add_search(name, results)
+      Datastore._schedule_flush()
+    Datastore._remember(results)
+    Datastore.search_results.put(name, results)
     return results
 
   @staticmethod
   def get_hierarchy(geoname_id):
-    if geoname_id in Datastore.hierarchies:
-      return Datastore.hierarchies[geoname_id]
+    hierarchy = Datastore.hierarchies.get(geoname_id)
+    if hierarchy != None:
+      return hierarchy
     db = Datastore._geonames_db()
-    hierarchy = db.get_hierarchy(geoname_id)
+    hierarchy = db.get_hierarchy(geoname_id, *Datastore._ttls('hierarchy'))
+    if hierarchy == None and db.has_dump():
+      hierarchy = db.get_dump_hierarchy(geoname_id)
     if hierarchy == None:
-      hierarchy = GeoNamesAPI.get_hierarchy(geoname_id)[1:]  # skip Earth
-      db.store_hierarchy(hierarchy)
-    Datastore.hierarchies[geoname_id] = hierarchy
+      hierarchy = Datastore._request('hierarchy', geoname_id, lambda: GeoNamesAPI.get_hierarchy(geoname_id))
+      if hierarchy == None:
+        return []
+      hierarchy = hierarchy[1:]  # skip Earth
+      Datastore.pending.add_hierarchy(geoname_id, hierarchy)
+      Datastore._schedule_flush()
+    Datastore._remember(hierarchy)
+    Datastore.hierarchies.put(geoname_id, hierarchy)
     return hierarchy
 
   @staticmethod
   def get_children(geoname_id):
-    db = Datastore._geonames_db()
-    children = db.get_children(geoname_id)
+    children = Datastore.children.get(geoname_id)
+    if children != None:
+      return children
+    children = Datastore.pending.get_children(geoname_id)
     if children == None:
-      children = GeoNamesAPI.get_children(geoname_id)
-      db.store_children(geoname_id, children)
+      db = Datastore._geonames_db()
+      children = db.get_children(geoname_id, *Datastore._ttls('children'))
+      if children == None and db.has_dump():
+        children = db.get_dump_children(geoname_id)
+      if children == None:
+        children = Datastore._request('children', geoname_id, lambda: GeoNamesAPI.get_children(geoname_id))
+        if children == None:
+          # unlike an empty list, this must not be read as 'no children'
+          raise GeoNamesException(f'children of {geoname_id} unavailable')
+        Datastore.pending.add_children(geoname_id, children)
+        Datastore._schedule_flush()
+    Datastore._remember(children)
+    Datastore.children.put(geoname_id, children)
     return children
-  
+
+  @staticmethod
+  def _request(endpoint, key, request):
+    # returns None for failed requests, which are not repeated until their TTL expires
+    if Datastore.failures.contains(endpoint, key):
+      return None
+    try:
+      # concurrent identical requests wait for the first one
+      return Datastore.requests.do((endpoint, key), request)
+    except (GeoNamesException, OverpassException) as e:
+      print(f'datastore - {endpoint} request for {key} failed: {e}')
+      Datastore.failures.add(endpoint, key)
+      return None
+
+  @staticmethod
+  def _ttls(endpoint):
+    return (Datastore.positive_ttls.get(endpoint), Datastore.negative_ttls.get(endpoint))
+
+  @staticmethod
+  def caches():
+    return [Datastore.geonames, Datastore.hierarchies, Datastore.search_results,
+            Datastore.children, Datastore.osm_databases, Datastore.completions]
+
+  @staticmethod
+  def cache_stats():
+    return {c.name: c.stats() for c in Datastore.caches()}
+
+  @staticmethod
+  def clear_caches():
+    for c in Datastore.caches():
+      c.clear()
+    Datastore.failures.clear()
+
+  @staticmethod
+  def _remember(geonames):
+    for g in geonames:
+      Datastore.geonames.put(g.id, g)
+
+  @staticmethod
+  def flush_geonames():
+    # writes all buffered GeoNames data in one transaction
+    with Datastore.flush_lock:
+      batch = Datastore.pending.take()
+      if batch == None:
+        return
+      try:
+        Datastore._geonames_db().store_batch(*batch)
+      finally:
+        Datastore.pending.finish()
+
+  @staticmethod
+  def _schedule_flush():
+    if Datastore.pending.size() >= Datastore.geonames_flush_size:
+      Datastore.flush_geonames()
+    else:
+      Datastore.pending.schedule(Datastore.geonames_flush_interval, Datastore.flush_geonames)
+
   @staticmethod
   def _geonames_db():
-    db_path = Datastore._data_path('geonames', 'db', cache=True)
-    exists = os.path.exists(db_path)
-    sqlite_db = sqlite3.connect(db_path)
-    geonames_db = GeoNamesDatabase(sqlite_db)
-    if not exists:
-      geonames_db.create_tables()
-    return geonames_db
+    # one long-lived connection per thread, sqlite3 objects can't be shared
+    connections = Datastore.connections
+    if not hasattr(connections, 'geonames_db'):
+      db_path = Datastore._data_path('geonames', 'db', cache=True)
+      with Datastore.setup_lock, FileLock(db_path + '.lock'):
+        exists = os.path.exists(db_path)
+        sqlite_db = sqlite3.connect(db_path, timeout=30, cached_statements=256)
+        geonames_db = GeoNamesDatabase(sqlite_db)
+        if not exists:
+          geonames_db.create_tables()
+        geonames_db.migrate()
+        geonames_db.configure(Datastore.sqlite_pragmas)
+      connections.geonames_db = geonames_db
+    return connections.geonames_db
 
   @staticmethod
   def load_osm_database(geoname):
-    search_dist = Datastore.osm_search_dist
-    db_name = f'{geoname.id}-{search_dist}km'
-    db_path = Datastore._data_path(db_name, 'db', cache=True)
-    is_cached = os.path.exists(db_path)
-    if is_cached and os.stat(db_path).st_size == 0:
-      # inconsistent database state
-      os.remove(db_path) 
-      is_cached = False
-    sqlite_db = sqlite3.connect(db_path)
-    osm_db = OSMDatabase(sqlite_db)
+    bbox = GeoUtil.bounding_box(geoname.lat, geoname.lon, Datastore.osm_search_dist)
+    tiles = Datastore._osm_tiles(bbox)
+    Datastore._record_usage(geoname, tiles)
+
+    osm_db = Datastore.osm_databases.get(geoname.id)
+    if osm_db != None:
+      return osm_db
+
+    (available, complete) = Datastore._ensure_osm_tiles(geoname, tiles)
+    if not complete:
+      # until the failure expires, the same partial tile set is reused
+      osm_db = Datastore.osm_databases.get(tuple(available))
+      if osm_db != None and time.time() - osm_db.created < Datastore.negative_ttls['overpass']:
+        return osm_db
+    tile_dbs = []
+    opened = []
+    for tile in available:
+      tile_db = Datastore._open_osm_tile(tile)
+      if tile_db != None:
+        tile_dbs.append(tile_db)
+        opened.append(tile)
+    osm_db = OSMTileSet(tile_dbs, opened)
+
+    if Datastore.osm_name_index:
+      osm_db.load_name_index()
+
+    complete = complete and len(opened) == len(available)
+    Datastore.osm_databases.put(geoname.id if complete else tuple(opened), osm_db)
+    return osm_db
+
+  @staticmethod
+  def ensure_osm_tiles(geoname):
+    # only loads the missing tiles to disk, without opening them (e.g. to warm up the cache)
+    bbox = GeoUtil.bounding_box(geoname.lat, geoname.lon, Datastore.osm_search_dist)
+    tiles = Datastore._osm_tiles(bbox)
+    Datastore._record_usage(geoname, tiles)
+    return Datastore._ensure_osm_tiles(geoname, tiles)
 
-    if not is_cached:
-      print(f'lres - requesting OSM data for {geoname} ...')
-      bbox = GeoUtil.bounding_box(geoname.lat, geoname.lon, search_dist)
-      csv_reader = OverpassAPI.load_names_in_bounding_box(bbox, Datastore.osm_exclusions)
-      name_count = Datastore._store_osm_data(osm_db, csv_reader, 1, [2, 3, 4, 5, 6])
+  @staticmethod
+  def _ensure_osm_tiles(geoname, tiles):
+    missing = [] if Datastore.osm_offline else [t for t in tiles if not Datastore.osm_tile_cached(t)]
+    if len(missing) > 0:
+      # tiles shared with anchors loaded concurrently are only requested once
+      (claimed, loading) = Datastore._claim_osm_tiles(missing)
+      if len(claimed) > 0:
+        try:
+          with ExitStack() as stack:
+            # lock files coordinate with other processes sharing the cache
+            for tile in sorted(claimed):
+              stack.enter_context(FileLock(Datastore._osm_tile_path(tile) + '.lock'))
+            # another process might have loaded some of them meanwhile
+            to_load = [t for t in claimed if not Datastore.osm_tile_cached(t)]
+            if len(to_load) > 0:
+              print(f'lres - requesting OSM data for {geoname} ({len(to_load)}/{len(tiles)} tiles) ...')
+              Datastore._request('overpass', geoname.id, lambda: Datastore._load_osm_tiles(to_load))
+        finally:
+          Datastore._release_osm_tiles(claimed)
+      for event in loading:
+        event.wait()
+    complete = all(Datastore.osm_tile_cached(t) for t in missing)
+
+    if len(missing) > 0 and Datastore.cache_quota != None:
+      Datastore.enforce_cache_quota(Datastore.cache_quota)
+
+    # after a failed request, continue with the tiles we have (even if outdated)
+    available = [t for t in tiles if Datastore.osm_tile_cached(t, fresh=False)]
+    return (available, complete)
+
+  @staticmethod
+  def count_osm_elements(tiles):
+    # distinct elements, large ones are stored in every tile they intersect
+    elements = set()
+    for tile in tiles:
+      osm_db = Datastore._open_osm_tile(tile)
+      if osm_db != None:
+        elements.update(e.reference for e in osm_db.get_all_elements())
+    return len(elements)
+
+  @staticmethod
+  def _record_usage(geoname, tiles):
+    now = time.time()
+    with Datastore.usage_lock:
+      usage = Datastore.anchor_usage.get(geoname.id)
+      if usage == None:
+        usage = Datastore.anchor_usage[geoname.id] = [geoname.name, geoname.lat, geoname.lon, 0, now]
+      usage[3] += 1
+      usage[4] = now
+      for tile in tiles:
+        usage = Datastore.tile_usage.get(tile)
+        if usage == None:
+          usage = Datastore.tile_usage[tile] = [0, now]
+        usage[0] += 1
+        usage[1] = now
+      due = now - Datastore.usage_flushed > Datastore.usage_flush_interval
+    if due:
+      Datastore.flush_usage()
+
+  @staticmethod
+  def flush_usage():
+    with Datastore.usage_lock:
+      anchor_rows = [(i, *u) for i, u in Datastore.anchor_usage.items()]
+      tile_rows = [(*t, *u) for t, u in Datastore.tile_usage.items()]
+      Datastore.anchor_usage = {}
+      Datastore.tile_usage = {}
+      Datastore.usage_flushed = time.time()
+    if len(anchor_rows) == 0 and len(tile_rows) == 0:
+      return
+    Datastore._usage_db().add_usage(anchor_rows, tile_rows)
+
+  @staticmethod
+  def enforce_cache_quota(quota):
+    # evicts the least recently used OSM tiles until they fit the quota (in bytes),
+    # the other cache files can't be evicted and are not counted
+    tile_paths = set(Datastore._osm_tile_path(t) for t in Datastore.cached_osm_tiles())
+    other_size = 0
+    for e in os.scandir(Datastore.cache_dir):
+      if e.is_file() and e.path not in tile_paths:
+        other_size += e.stat().st_size
+    if other_size > quota:
+      print(f'datastore - warning: {other_size / 1e6:.1f}MB of cache files besides OSM tiles exceed the cache quota')
+
+    tiles = []
+    for tile in Datastore.cached_osm_tiles():
+      db_path = Datastore._osm_tile_path(tile)
+      try:
+        stat = os.stat(db_path)
+      except FileNotFoundError:
+        continue # evicted concurrently
+      tiles.append((tile, db_path, stat))
+    total = sum(stat.st_size for _, _, stat in tiles)
+    if total <= quota:
+      return []
+
+    Datastore.flush_usage()
+    db = Datastore._usage_db()
+    last_access = {t: u[1] for t, u in db.get_tiles().items()}
+    # tiles that were never used (e.g. imported) count from their creation
+    tiles = sorted((last_access.get(t, s.st_mtime), s.st_size, t, p) for t, p, s in tiles)
 
+    evicted = []
+    for _, size, tile, db_path in tiles:
+      if total <= quota:
+        break
+      lock_path = db_path + '.lock'
+      # wait for loads of the tile in other threads and processes
+      with FileLock(lock_path):
+        if os.path.exists(db_path):
+          os.remove(db_path)
+        os.remove(lock_path)
+      total -= size
+      evicted.append(tile)
+    db.delete_tiles(evicted)
+    # cached tile sets would keep the space of deleted files allocated
+    evicted_set = set(evicted)
+    tile_sets = Datastore.osm_databases.remove_where(lambda _, s: any(t in evicted_set for t in s.tiles))
+    # and the completion templates of their gazetteers are stale
+    ids = set(s.id for s in tile_sets if s.id != None)
+    Datastore.completions.remove_where(lambda k, _: k[0] in ids)
+    print(f'datastore - evicted {len(evicted)} OSM tiles to stay within the cache quota')
+    return evicted
+
+  @staticmethod
+  def remove_legacy_osm_databases():
+    # per-anchor databases from before the tiles are not migrated, their elements
+    # have no coordinates to assign them to tiles, so the data is reloaded as tiles
+    pattern = re.compile(r'^\d+-\d+(\.\d+)?km\.db(-journal|-wal|-shm|\.lock)?$')
+    removed = 0
+    for file_name in os.listdir(Datastore.cache_dir):
+      if pattern.match(file_name):
+        os.remove(os.path.join(Datastore.cache_dir, file_name))
+        removed += 1
+    if removed > 0:
+      print(f'datastore - removed {removed} legacy per-anchor OSM database files')
+    return removed
+
+  @staticmethod
+  def _usage_db():
+    db_path = Datastore._data_path('usage', 'db', cache=True)
+    with Datastore.setup_lock, FileLock(db_path + '.lock'):
+      exists = os.path.exists(db_path)
+      sqlite_db = sqlite3.connect(db_path, timeout=30)
+      usage_db = UsageDatabase(sqlite_db)
+      if not exists:
+        usage_db.create_tables()
+    return usage_db
+
+  @staticmethod
+  def _open_osm_tile(tile):
+    db_path = Datastore._osm_tile_path(tile)
+    # read-only, so a tile evicted meanwhile is not recreated as an empty file
+    uri = pathlib.Path(db_path).absolute().as_uri() + '?mode=ro'
+    try:
+      # tile sets are loaded in worker threads and shared via the cache
+      sqlite_db = sqlite3.connect(uri, uri=True, check_same_thread=False)
+      osm_db = OSMDatabase(sqlite_db)
+    except sqlite3.OperationalError as e:
+      # e.g. evicted by another process meanwhile
+      print(f'datastore - could not open OSM tile {tile}: {e}')
+      return None
     return osm_db
 
   @staticmethod
-  def _store_osm_data(osm_db, csv_reader, type_col, name_cols):
+  def cached_osm_database(bbox):
+    # the cached tiles in the bounding box only, missing tiles are not loaded
+    tiles = [t for t in Datastore._osm_tiles(bbox) if Datastore.osm_tile_cached(t, fresh=False)]
+    tile_dbs = [Datastore._open_osm_tile(t) for t in tiles]
+    return OSMTileSet([db for db in tile_dbs if db != None], tiles)
+
+  @staticmethod
+  def _claim_osm_tiles(tiles):
+    claimed = []
+    loading = []
+    with Datastore.osm_tile_lock:
+      for tile in tiles:
+        event = Datastore.osm_tile_loads.get(tile)
+        if event == None:
+          Datastore.osm_tile_loads[tile] = threading.Event()
+          claimed.append(tile)
+        else:
+          loading.append(event)
+    return (claimed, loading)
+
+  @staticmethod
+  def _release_osm_tiles(tiles):
+    with Datastore.osm_tile_lock:
+      for tile in tiles:
+        Datastore.osm_tile_loads.pop(tile).set()
+
+  @staticmethod
+  def _osm_tiles(bbox):
+    (s, w) = Datastore.osm_tile(bbox.s, bbox.w)
+    (n, e) = Datastore.osm_tile(bbox.n, bbox.e)
+    return [(y, x) for y in range(s, n + 1) for x in range(w, e + 1)]
+
+  @staticmethod
+  def osm_tile(lat, lon):
+    size = Datastore.osm_tile_size
+    return (math.floor(lat / size), math.floor(lon / size))
+
+  @staticmethod
+  def _osm_tile_path(tile):
+    (y, x) = tile
+    db_name = f'osm-{Datastore.osm_tile_size}-{y}_{x}'
+    return Datastore._data_path(db_name, 'db', cache=True)
+
+  @staticmethod
+  def osm_tile_cached(tile, fresh=True):
+    db_path = Datastore._osm_tile_path(tile)
+    if not os.path.exists(db_path):
+      return False
+    stat = os.stat(db_path)
+    if stat.st_size == 0:
+      # inconsistent database state
+      os.remove(db_path)
+      return False
+    ttl = Datastore.positive_ttls['overpass']
+    if fresh and ttl != None and time.time() - stat.st_mtime > ttl:
+      return False
+    return True
+
+  @staticmethod
+  def _load_osm_tiles(tiles):
+    # one query for the area spanned by all missing tiles
+    size = Datastore.osm_tile_size
+    s = min(y for y, _ in tiles)
+    w = min(x for _, x in tiles)
+    n = max(y for y, _ in tiles) + 1
+    e = max(x for _, x in tiles) + 1
+    bbox = BoundingBox(round(s * size, 6), round(w * size, 6),
+                       round(n * size, 6), round(e * size, 6))
+    rows = OverpassAPI.load_names_in_bounding_box(bbox, Datastore.osm_exclusions)
+
+    tile_rows = Datastore.assign_osm_rows(rows, tiles)
+
+    start_time = time.time()
+    row_count = 0
+    for tile, rows in tile_rows.items():
+      row_count += Datastore.store_osm_tile(tile, rows)
+    rate = row_count / max(time.time() - start_time, 0.001)
+    print(f'lres - stored {row_count} OSM elements in {len(tiles)} tiles ({rate:.0f} rows/s)')
+    return row_count
+
+  @staticmethod
+  def assign_osm_rows(rows, tiles):
+    # elements are stored in every given tile they intersect, so that long ways
+    # and large relations reach all anchors whose area they cross
+    tile_rows = {t: [] for t in tiles}
+    min_y = min(y for y, _ in tiles)
+    min_x = min(x for _, x in tiles)
+    max_y = max(y for y, _ in tiles)
+    max_x = max(x for _, x in tiles)
+    for row in rows:
+      if len(row) != 13:
+        continue
+      (s, w) = Datastore.osm_tile(row[9], row[10])
+      (n, e) = Datastore.osm_tile(row[11], row[12])
+      for y in range(max(s, min_y), min(n, max_y) + 1):
+        for x in range(max(w, min_x), min(e, max_x) + 1):
+          if (y, x) in tile_rows:
+            tile_rows[(y, x)].append(row)
+    return tile_rows
+
+  @staticmethod
+  def store_osm_tile(tile, rows):
+    # rows have the layout of OverpassAPI.load_names_in_bounding_box
+    (elements, geometries) = Datastore._osm_elements(rows)
+    return Datastore._write_osm_tile(tile, elements, geometries)
+
+  @staticmethod
+  def cached_osm_tiles():
+    prefix = f'osm-{Datastore.osm_tile_size}-'
+    tiles = []
+    for file_name in os.listdir(Datastore.cache_dir):
+      if file_name.startswith(prefix) and file_name.endswith('.db'):
+        (y, x) = file_name[len(prefix):-3].split('_')
+        tiles.append((int(y), int(x)))
+    return sorted(tiles)
+
+  @staticmethod
+  def _write_osm_tile(tile, elements, geometries):
+    # write to a temporary file first so readers never see a partial tile
+    db_path = Datastore._osm_tile_path(tile)
+    tmp_path = db_path + '.tmp'
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+    sqlite_db = sqlite3.connect(tmp_path)
+    osm_db = OSMDatabase(sqlite_db)
     osm_db.create_tables()
+    row_count = osm_db.insert_elements(elements, geometries)
+    sqlite_db.close()
+    os.replace(tmp_path, db_path)
+    return row_count
+
+  @staticmethod
+  def _osm_elements(rows):
     min_match_len = Datastore.osm_name_min_length
 
-    col_num = len(name_cols) + 2
-    name_count = 0
-    for row in csv_reader:
-      if len(row) != col_num:
+    elements = {}  # name: [(ref, type_code)]
+    geometries = {}  # (ref, type_code): (s, w, n, e)
+    for row in rows:
+      if len(row) != 13:
         continue
-      type_name = row[type_col]
-      names = set(map(lambda c: row[c], name_cols))
+      type_code = OSMElement.type_names.index(row[1])
+      names = set(row[4:9])
       for name in names:
-        if len(name) >= min_match_len:
-          name_count += osm_db.insert_element(name, type_name, row[0])
-
-    osm_db.commit_changes()
-    return name_count
+        if len(name) < min_match_len:
+          continue
+        first = name[0]
+        if not first.isupper() and not first.isdigit():
+          continue
+        if name not in elements:
+          elements[name] = []
+        elements[name].append((row[0], type_code))
+        geometries[(row[0], type_code)] = row[9:13]
+    return (elements, geometries)
 
   @staticmethod
-  def load_osm_geometries(elements):
-    cache_key = 'geometries'
-    if Datastore.data_available(cache_key, in_cache=True):
-      cache = Datastore.load_data(cache_key, from_cache=True)
-    else:
-      cache = {}
+  def load_osm_geometries(elements, osm_dbs=None):
+    # geometries are stored with the names in the tiles, elements outside the given
+    # tiles fall back to the geometry cache and Overpass
+    stored = {}
+    for osm_db in osm_dbs or []:
+      missing = [e for e in elements if e.reference not in stored]
+      if len(missing) > 0:
+        stored.update(osm_db.get_geometries(missing))
+    remaining = [e.reference for e in elements if e.reference not in stored]
+    db = None
+    cached = {}
+    if len(remaining) > 0:
+      db = Datastore._geometries_db()
+      cached = db.get_many(remaining)
 
     geometries = {'node': {}, 'way': {}, 'relation': {}}
 
     not_cached = []
     for e in elements:
-      if e.reference in cache:
-        geometries[e.type_name][e.id] = cache[e.reference]
-      else:
+      if e.reference in stored:
+        geometries[e.type_name][e.id] = stored[e.reference]
+      elif e.reference in cached:
+        geometries[e.type_name][e.id] = cached[e.reference]
+      elif not Datastore.osm_offline and not Datastore.failures.contains('geometries', e.reference):
         not_cached.append(e)
 
     if len(not_cached) > 0:
-      data = OverpassAPI.load_geometries(not_cached)
+      try:
+        data = OverpassAPI.load_geometries(not_cached)
+      except OverpassException as ex:
+        print(f'datastore - geometries request failed: {ex}')
+        for e in not_cached:
+          Datastore.failures.add('geometries', e.reference)
+        data = []
+      new_entries = {}
       for d in data:
         type_name = d['type']
         el_id = d['id']
@@ -145,13 +720,31 @@ class Datastore:
         else:
           b = d['bounds']
           geometry = [b['minlat'], b['minlon'], b['maxlat'], b['maxlon']]
-        cache[reference] = geometry
+        new_entries[reference] = geometry
         geometries[type_name][el_id] = geometry
-
-    Datastore.save_data(cache_key, cache, to_cache=True)
+      db.put_many(new_entries)
 
     return geometries
 
+  @staticmethod
+  def _geometries_db():
+    connections = Datastore.connections
+    if not hasattr(connections, 'geometries_db'):
+      db_path = Datastore._data_path('geometries', 'db', cache=True)
+      with Datastore.setup_lock, FileLock(db_path + '.lock'):
+        exists = os.path.exists(db_path)
+        sqlite_db = sqlite3.connect(db_path, timeout=30)
+        geometries_db = GeometryDatabase(sqlite_db)
+        if not exists:
+          geometries_db.create_tables()
+          legacy_key = 'geometries'
+          if Datastore.data_available(legacy_key, in_cache=True):
+            legacy = Datastore.load_data(legacy_key, from_cache=True)
+            geometries_db.put_many(legacy)
+        geometries_db.configure(Datastore.sqlite_pragmas)
+      connections.geometries_db = geometries_db
+    return connections.geometries_db
+
   @staticmethod
   def save_object(key, model, to_cache=False):
     model_path = Datastore._data_path(key, 'pickle', to_cache)
@@ -195,6 +788,11 @@ class Datastore:
     return f'{data_dir}/{file_name}.{file_ext}'
 
 
+atexit.register(Datastore.flush_geonames)
+atexit.register(Datastore.pending.stop)
+atexit.register(Datastore.flush_usage)
+
+
 class Database:
 
   def __init__(self, sqlite_db):
@@ -207,6 +805,10 @@ class Database:
   def commit_changes(self):
     self.db.commit()
   
+  def configure(self, pragmas):
+    for p in pragmas:
+      self.cursor.execute(f'PRAGMA {p}')
+
   def initialize(self, statements):
     for s in statements:
       self.cursor.execute(s)
@@ -215,75 +817,264 @@ class Database:
 
 class GeoNamesDatabase(Database):
 
+  earth_id = 6295630
+  dump_available = None
+  dump_search_limit = 100
+  country_codes = ['PCLI', 'PCLD', 'PCLF', 'PCLS', 'PCLIX', 'PCL', 'TERR']
+  city_codes = ['PPL', 'PPLA', 'PPLA2', 'PPLA3', 'PPLA4', 'PPLA5', 'PPLC', 'PPLCH', 'PPLF', 'PPLG',
+                'PPLH', 'PPLL', 'PPLQ', 'PPLR', 'PPLS', 'PPLW', 'PPLX', 'STLMT']
+
+  schema_version = 1
+  list_tables = [
+      'CREATE TABLE searches (name TEXT PRIMARY KEY, fetched REAL)',
+      'CREATE TABLE search_results (name TEXT, rank INT, geoname_id INT, PRIMARY KEY (name, rank)) WITHOUT ROWID',
+      'CREATE TABLE hierarchies (geoname_id INTEGER PRIMARY KEY, fetched REAL)',
+      'CREATE TABLE hierarchy_ancestors (geoname_id INT, rank INT, ancestor_id INT, PRIMARY KEY (geoname_id, rank)) WITHOUT ROWID',
+      'CREATE TABLE child_lists (geoname_id INTEGER PRIMARY KEY, fetched REAL)',
+      'CREATE TABLE child_ids (geoname_id INT, rank INT, child_id INT, PRIMARY KEY (geoname_id, rank)) WITHOUT ROWID']
+
   def create_tables(self):
     self.initialize(
         ['CREATE TABLE geonames (geoname_id INT UNIQUE, name TEXT, population INT, lat REAL, lng REAL, fcl CHAR(1), fcode VARCHAR(10), cc CHAR(2), adm1 TEXT, toponame TEXT)',
-        'CREATE TABLE search (name TEXT UNIQUE, result_ids TEXT)',
-        'CREATE TABLE hierarchy (geoname_id INT UNIQUE, ancestor_ids TEXT)',
-        'CREATE TABLE children (geoname_id INT UNIQUE, child_ids TEXT)'])
-
-  def get_search(self, name):
-    self.cursor.execute('SELECT result_ids FROM search WHERE name = ?',
-                        (name, ))
-    row = self.cursor.fetchone()
-    return self._resolve_ids(row)
+        *self.list_tables,
+        f'PRAGMA user_version = {self.schema_version}'])
 
-  def store_search(self, name, geonames):
-    result_ids = ','.join(str(g.id) for g in geonames)
-    try:
-      self.cursor.execute('INSERT INTO search VALUES (?, ?)',
-                        (name, result_ids))
-    except:
-      pass
-    for geoname in geonames:
-      self.store_geoname(geoname)
+  def migrate(self):
+    self.cursor.execute('PRAGMA user_version')
+    version = self.cursor.fetchone()[0]
+    if version >= self.schema_version:
+      return
+    # version 0 stored result lists as comma-separated ids
+    self.initialize(self.list_tables)
+    old_tables = [('search', 'searches', 'search_results'),
+                  ('hierarchy', 'hierarchies', 'hierarchy_ancestors'),
+                  ('children', 'child_lists', 'child_ids')]
+    for old_table, key_table, list_table in old_tables:
+      self.cursor.execute(f'SELECT * FROM {old_table}')
+      rows = self.cursor.fetchall()
+      keys = [(key, None) for key, _ in rows]
+      items = []
+      for key, ids in rows:
+        if ids != '':
+          items.extend((key, rank, int(i)) for rank, i in enumerate(ids.split(',')))
+      self.cursor.executemany(f'INSERT OR IGNORE INTO {key_table} VALUES (?, ?)', keys)
+      self.cursor.executemany(f'INSERT OR IGNORE INTO {list_table} VALUES (?, ?, ?)', items)
+      self.cursor.execute(f'DROP TABLE {old_table}')
+    self.cursor.execute(f'PRAGMA user_version = {self.schema_version}')
     self.commit_changes()
 
-  def get_hierarchy(self, geoname_id):
-    self.cursor.execute('SELECT ancestor_ids FROM hierarchy WHERE geoname_id = ?',
+  def create_dump_tables(self):
+    self.dump_available = None
+    self.initialize(
+        ['DROP TABLE IF EXISTS dump_names',
+        'DROP TABLE IF EXISTS admin_codes',
+        'DROP TABLE IF EXISTS parents',
+        'CREATE TABLE dump_names (key TEXT NOT NULL, geoname_id INT NOT NULL)',
+        'CREATE TABLE admin_codes (geoname_id INTEGER PRIMARY KEY, fcode VARCHAR(10), cc CHAR(2), adm1 TEXT, adm2 TEXT, adm3 TEXT, adm4 TEXT)',
+        'CREATE TABLE parents (parent_id INT NOT NULL, child_id INT NOT NULL)'])
+
+  def create_dump_indices(self):
+    # parents_child_index is created last and marks a complete import
+    self.dump_available = None
+    self.initialize(
+        ['CREATE INDEX dump_names_index ON dump_names(key)',
+        'CREATE INDEX admin_codes_index ON admin_codes(cc, fcode, adm1)',
+        'CREATE INDEX parents_parent_index ON parents(parent_id)',
+        'CREATE INDEX parents_child_index ON parents(child_id)'])
+
+  def has_dump(self):
+    if self.dump_available == None:
+      self.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = 'parents_child_index'")
+      self.dump_available = self.cursor.fetchone() != None
+    return self.dump_available
+
+  def store_dump_geonames(self, geoname_rows, admin_rows, name_rows):
+    self.cursor.executemany('INSERT OR REPLACE INTO geonames VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', geoname_rows)
+    self.cursor.executemany('INSERT OR REPLACE INTO admin_codes VALUES (?, ?, ?, ?, ?, ?, ?)', admin_rows)
+    self.cursor.executemany('INSERT INTO dump_names VALUES (?, ?)', name_rows)
+
+  def store_dump_names(self, name_rows, display_names):
+    self.cursor.executemany('INSERT INTO dump_names VALUES (?, ?)', name_rows)
+    self.cursor.executemany('UPDATE geonames SET name = ? WHERE geoname_id = ?', display_names)
+
+  def store_dump_parents(self, parent_rows):
+    self.cursor.executemany('INSERT INTO parents VALUES (?, ?)', parent_rows)
+
+  def get_dump_search(self, name, feature_classes):
+    params = ','.join('?' * len(feature_classes))
+    self.cursor.execute('SELECT DISTINCT g.* FROM dump_names n JOIN geonames g ON g.geoname_id = n.geoname_id ' +
+                        f'WHERE n.key = ? AND g.fcl IN ({params}) AND g.geoname_id != ? ' +
+                        'ORDER BY g.population DESC LIMIT ?',
+                        (name.lower(), *feature_classes, self.earth_id, self.dump_search_limit))
+    return [GeoName(row=row) for row in self.cursor.fetchall()]
+
+  def get_dump_cities(self, min_population, country_codes=None):
+    query = 'SELECT * FROM geonames WHERE fcl = ? AND population >= ?'
+    params = ['P', min_population]
+    if country_codes != None:
+      query += f' AND cc IN ({",".join("?" * len(country_codes))})'
+      params += country_codes
+    self.cursor.execute(query + ' ORDER BY population DESC', params)
+    return [GeoName(row=row) for row in self.cursor.fetchall()]
+
+  def get_dump_hierarchy(self, geoname_id):
+    if not self._in_dump(geoname_id):
+      return None
+    hierarchy = []
+    visited = set()
+    current = geoname_id
+    while current != None and current != self.earth_id and current not in visited:
+      geoname = self.get_geoname(current)
+      if geoname == None:
+        break
+      hierarchy.insert(0, geoname)
+      visited.add(current)
+      current = self._dump_parent(current)
+    return hierarchy
+
+  def get_dump_children(self, geoname_id):
+    if not self._in_dump(geoname_id):
+      return None
+    self.cursor.execute('SELECT g.* FROM parents p JOIN geonames g ON g.geoname_id = p.child_id ' +
+                        'WHERE p.parent_id = ?', (geoname_id, ))
+    children = [GeoName(row=row) for row in self.cursor.fetchall()]
+    # hierarchy.txt only relates admin divisions, places are placed by their admin codes
+    child_ids = set(g.id for g in children)
+    for child_id in self._dump_code_children(geoname_id):
+      if child_id not in child_ids:
+        children.append(self.get_geoname(child_id))
+    return sorted(children, key=lambda g: g.name)
+
+  def _dump_code_children(self, geoname_id):
+    # reverse of _dump_parent for populated places
+    self.cursor.execute('SELECT fcode, cc, adm1, adm2, adm3, adm4 FROM admin_codes WHERE geoname_id = ?',
                         (geoname_id, ))
-    row = self.cursor.fetchone()
-    return self._resolve_ids(row)
+    (fcode, cc, *codes) = self.cursor.fetchone()
+    if fcode in self.country_codes:
+      depth = 0
+    elif fcode in ['ADM1', 'ADM2', 'ADM3', 'ADM4'] and '' not in codes[:int(fcode[3])]:
+      depth = int(fcode[3])
+    else:
+      return []
 
-  def store_hierarchy(self, geonames):
-    geoname_id = geonames[-1].id
-    ancestor_ids = ','.join(str(g.id) for g in geonames)
-    try:
-      self.cursor.execute('INSERT INTO hierarchy VALUES (?, ?)',
-                        (geoname_id, ancestor_ids))
-    except:
-      pass
-    for geoname in geonames:
-      self.store_geoname(geoname)
-    self.commit_changes()
+    params = ','.join('?' * len(self.city_codes))
+    query = f'SELECT geoname_id, adm1, adm2, adm3, adm4 FROM admin_codes WHERE cc = ? AND fcode IN ({params}) AND adm1 = ?'
+    self.cursor.execute(query, (cc, *self.city_codes, codes[0] if depth > 0 else ''))
+    rows = [r for r in self.cursor.fetchall() if list(r[1:depth+1]) == codes[:depth]]
 
-  def get_children(self, geoname_id):
-    self.cursor.execute('SELECT child_ids FROM children WHERE geoname_id = ?',
+    divisions = {} # admin codes: whether the admin division exists
+    def has_division(child_codes, child_depth):
+      key = tuple(child_codes[:child_depth])
+      if key not in divisions:
+        adm_codes = list(key) + [''] * (4 - child_depth)
+        self.cursor.execute('SELECT geoname_id FROM admin_codes WHERE cc = ? AND fcode = ? ' +
+                            'AND adm1 = ? AND adm2 = ? AND adm3 = ? AND adm4 = ? LIMIT 1',
+                            (cc, f'ADM{child_depth}', *adm_codes))
+        divisions[key] = self.cursor.fetchone() != None
+      return divisions[key]
+
+    child_ids = []
+    for (child_id, *child_codes) in rows:
+      # a deeper admin division would be the parent
+      deeper = [d for d in range(depth + 1, 5) if child_codes[d-1] != '' and has_division(child_codes, d)]
+      if len(deeper) == 0:
+        child_ids.append(child_id)
+
+    # features with an explicit parent are not placed by their admin codes
+    with_parent = set()
+    for i in range(0, len(child_ids), 500):
+      batch = child_ids[i:i+500]
+      self.cursor.execute(f'SELECT child_id FROM parents WHERE child_id IN ({",".join("?" * len(batch))})', batch)
+      with_parent.update(r[0] for r in self.cursor.fetchall())
+    return [i for i in child_ids if i not in with_parent]
+
+  def _in_dump(self, geoname_id):
+    self.cursor.execute('SELECT geoname_id FROM admin_codes WHERE geoname_id = ?', (geoname_id, ))
+    return self.cursor.fetchone() != None
+
+  def _dump_parent(self, geoname_id):
+    self.cursor.execute('SELECT parent_id FROM parents WHERE child_id = ? LIMIT 1', (geoname_id, ))
+    row = self.cursor.fetchone()
+    if row != None:
+      return row[0]
+
+    # features without an explicit parent belong to their deepest admin division
+    self.cursor.execute('SELECT fcode, cc, adm1, adm2, adm3, adm4 FROM admin_codes WHERE geoname_id = ?',
                         (geoname_id, ))
     row = self.cursor.fetchone()
-    return self._resolve_ids(row)
+    if row == None or row[0] in self.country_codes:
+      return None
+    (fcode, cc, *codes) = row
+    for depth in range(4, 0, -1):
+      if fcode.startswith('ADM') and fcode[3:] <= str(depth):
+        continue
+      if codes[depth-1] == '':
+        continue
+      adm_codes = codes[:depth] + [''] * (4 - depth)
+      self.cursor.execute('SELECT geoname_id FROM admin_codes WHERE cc = ? AND fcode = ? ' +
+                          'AND adm1 = ? AND adm2 = ? AND adm3 = ? AND adm4 = ? LIMIT 1',
+                          (cc, f'ADM{depth}', *adm_codes))
+      row = self.cursor.fetchone()
+      if row != None:
+        return row[0]
 
-  def store_children(self, geoname_id, geonames):
-    child_ids = ','.join(str(g.id) for g in geonames)
-    try:
-      self.cursor.execute('INSERT INTO children VALUES (?, ?)',
-                        (geoname_id, child_ids))
-    except:
-      pass
-    for geoname in geonames:
-      self.store_geoname(geoname)
-    self.commit_changes()
+    params = ','.join('?' * len(self.country_codes))
+    self.cursor.execute(f'SELECT geoname_id FROM admin_codes WHERE cc = ? AND fcode IN ({params}) ' +
+                        "ORDER BY fcode = 'PCLI' DESC LIMIT 1", (cc, *self.country_codes))
+    row = self.cursor.fetchone()
+    return None if row == None else row[0]
 
-  def _resolve_ids(self, row):
-    if row == None:
-      return None
-    if row[0] == '':
+  def get_search(self, name, ttl=None, empty_ttl=None):
+    return self._get_list('searches', 'search_results', 'name', 'geoname_id',
+                          name, ttl, empty_ttl)
+
+  def get_hierarchy(self, geoname_id, ttl=None, empty_ttl=None):
+    return self._get_list('hierarchies', 'hierarchy_ancestors', 'geoname_id', 'ancestor_id',
+                          geoname_id, ttl, empty_ttl)
+
+  def get_children(self, geoname_id, ttl=None, empty_ttl=None):
+    return self._get_list('child_lists', 'child_ids', 'geoname_id', 'child_id',
+                          geoname_id, ttl, empty_ttl)
+
+  def _get_list(self, key_table, list_table, key_col, id_col, key, ttl, empty_ttl):
+    self.cursor.execute(f'SELECT k.fetched, l.{id_col}, g.* FROM {key_table} k ' +
+                        f'LEFT JOIN {list_table} l ON l.{key_col} = k.{key_col} ' +
+                        f'LEFT JOIN geonames g ON g.geoname_id = l.{id_col} ' +
+                        f'WHERE k.{key_col} = ? ORDER BY l.rank', (key, ))
+    rows = self.cursor.fetchall()
+    if len(rows) == 0:
+      return None  # not cached
+    fetched = rows[0][0]
+    is_empty = rows[0][1] == None
+    max_age = empty_ttl if is_empty else ttl
+    if fetched != None and max_age != None and time.time() - fetched > max_age:
+      return None  # outdated, refetch
+    if is_empty:
       return []
-    geonames = [self.get_geoname(int(s)) for s in row[0].split(',')]
-    if None in geonames:
-      return None
-    else:
-      return geonames
+    if any(row[2] == None for row in rows):
+      return None  # incomplete, refetch
+    return [GeoName(row=row[2:]) for row in rows]
+
+  def store_batch(self, geonames, searches, hierarchies, children):
+    geoname_rows = [(g.id, g.name, g.population, g.lat, g.lon,
+                     g.fcl, g.fcode, g.cc, g.adm1, g.toponym_name) for g in geonames]
+    self.cursor.executemany('INSERT OR IGNORE INTO geonames VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            geoname_rows)
+    self._store_lists('searches', 'search_results', searches)
+    self._store_lists('hierarchies', 'hierarchy_ancestors', hierarchies)
+    self._store_lists('child_lists', 'child_ids', children)
+    self.commit_changes()
+
+  def _store_lists(self, key_table, list_table, geoname_lists):
+    fetched = time.time()
+    keys = [(key, fetched) for key in geoname_lists]
+    items = [(key, rank, g.id) for key, geonames in geoname_lists.items()
+             for rank, g in enumerate(geonames)]
+    key_col = 'name' if key_table == 'searches' else 'geoname_id'
+    # refreshed lists replace the outdated ones
+    self.cursor.executemany(f'DELETE FROM {list_table} WHERE {key_col} = ?', [k[:1] for k in keys])
+    self.cursor.executemany(f'INSERT OR REPLACE INTO {key_table} VALUES (?, ?)', keys)
+    self.cursor.executemany(f'INSERT INTO {list_table} VALUES (?, ?, ?)', items)
 
   def get_geoname(self, geoname_id):
     self.cursor.execute('SELECT * FROM geonames WHERE geoname_id = ?',
@@ -291,57 +1082,231 @@ class GeoNamesDatabase(Database):
     row = self.cursor.fetchone()
     return None if row == None else GeoName(row=row)
 
-  def store_geoname(self, geoname):
-    g = geoname
-    try:
-      self.cursor.execute('INSERT INTO geonames VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                          (g.id, g.name, g.population, g.lat, g.lon,
-                           g.fcl, g.fcode, g.cc, g.adm1, g.toponym_name))
-      self.commit_changes()
-    except sqlite3.Error:
-      pass
-
-    
+
+class GeometryDatabase(Database):
+
+  batch_size = 500 # SQLite host parameter limit is 999
+
+  def create_tables(self):
+    self.initialize(
+        ['CREATE TABLE geometries (ref VARCHAR(30) PRIMARY KEY, geometry TEXT NOT NULL)'])
+
+  def get_many(self, references):
+    references = list(set(references))
+    geometries = {}
+    for i in range(0, len(references), self.batch_size):
+      batch = references[i:i+self.batch_size]
+      params = ','.join('?' * len(batch))
+      self.cursor.execute(f'SELECT ref, geometry FROM geometries WHERE ref IN ({params})', batch)
+      for ref, geometry in self.cursor.fetchall():
+        geometries[ref] = json.loads(geometry)
+    return geometries
+
+  def put_many(self, geometries):
+    if len(geometries) == 0:
+      return
+    rows = [(ref, json.dumps(g)) for ref, g in geometries.items()]
+    self.cursor.executemany('INSERT OR REPLACE INTO geometries VALUES (?, ?)', rows)
+    self.commit_changes()
+
+
+class UsageDatabase(Database):
+
+  def create_tables(self):
+    self.initialize(
+        ['CREATE TABLE anchors (geoname_id INTEGER PRIMARY KEY, name TEXT, lat REAL, lon REAL, hits INT, last_access REAL)',
+        'CREATE TABLE tiles (y INT, x INT, hits INT, last_access REAL, PRIMARY KEY (y, x)) WITHOUT ROWID'])
+
+  def add_usage(self, anchor_rows, tile_rows):
+    self.cursor.executemany('INSERT INTO anchors VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (geoname_id) ' +
+                            'DO UPDATE SET hits = hits + excluded.hits, last_access = max(last_access, excluded.last_access)', anchor_rows)
+    self.cursor.executemany('INSERT INTO tiles VALUES (?, ?, ?, ?) ON CONFLICT (y, x) ' +
+                            'DO UPDATE SET hits = hits + excluded.hits, last_access = max(last_access, excluded.last_access)', tile_rows)
+    self.commit_changes()
+
+  def get_anchors(self):
+    self.cursor.execute('SELECT * FROM anchors ORDER BY hits DESC')
+    return self.cursor.fetchall()
+
+  def get_tiles(self):
+    self.cursor.execute('SELECT * FROM tiles')
+    return {(row[0], row[1]): (row[2], row[3]) for row in self.cursor.fetchall()}
+
+  def delete_tiles(self, tiles):
+    self.cursor.executemany('DELETE FROM tiles WHERE y = ? AND x = ?', tiles)
+    self.commit_changes()
+
+
 class OSMDatabase(Database):
 
+  schema_version = 1
+  max_params = 900 # SQLite host parameter limit is 999
+
   def create_tables(self):
+    # elements are packed as ref * 4 + type_code, names keep their insertion order in id
     self.initialize(
-        ['CREATE TABLE names (name VARCHAR(100) NOT NULL UNIQUE)',
-        'CREATE INDEX names_index ON names(name)',
-        'CREATE TABLE osm (ref BIGINT NOT NULL, names_rowid INTEGER NOT NULL, type_code TINYINT NOT NULL)',
-        'CREATE INDEX osm_index ON osm(names_rowid)'])
-
-  def insert_element(self, name, type_name, element_id):
-    first = name[0]
-    if not first.isupper() and not first.isdigit():
-      return 0
-    inserted = 0
+        ['CREATE TABLE names (name TEXT PRIMARY KEY, id INTEGER NOT NULL) WITHOUT ROWID',
+        'CREATE TABLE osm (name_id INTEGER NOT NULL, element INTEGER NOT NULL, PRIMARY KEY (name_id, element)) WITHOUT ROWID'])
+    # nodes are stored as bounds with s = n and w = e, the R*Tree keeps
+    # 32-bit floats and rounds bounds outwards (less than a meter)
     try:
-      self.cursor.execute('INSERT INTO names VALUES (?)', (name, ))
-      rowid = self.cursor.lastrowid
-      inserted = 1
-    except sqlite3.Error:
-      rowid = self.get_rowid(name)
-    type_code = OSMElement.type_names.index(type_name)
-    self.cursor.execute('INSERT INTO osm VALUES(?, ?, ?)',
-                        (element_id, rowid, type_code))
-    return inserted
+      self.cursor.execute('CREATE VIRTUAL TABLE geometries USING rtree(element, s, n, w, e)')
+    except sqlite3.OperationalError:
+      # SQLite without R*Tree module, bounding box queries scan the table
+      self.cursor.execute('CREATE TABLE geometries (element INTEGER PRIMARY KEY, s REAL, n REAL, w REAL, e REAL)')
+    self.initialize([f'PRAGMA user_version = {self.schema_version}'])
+
+  def insert_elements(self, elements, geometries):
+    # cache files can be rebuilt, so trade durability for load speed
+    self.cursor.execute('PRAGMA synchronous = OFF')
+    self.cursor.execute('PRAGMA journal_mode = MEMORY')
+
+    name_rows = []
+    osm_rows = []
+    for name_id, (name, refs) in enumerate(elements.items(), 1):
+      name_rows.append((name, name_id))
+      for ref, type_code in refs:
+        osm_rows.append((name_id, int(ref) * 4 + type_code))
+
+    geometry_rows = [(int(ref) * 4 + type_code, *bounds) for (ref, type_code), bounds in geometries.items()]
+
+    self.cursor.executemany('INSERT INTO names VALUES (?, ?)', name_rows)
+    self.cursor.executemany('INSERT OR IGNORE INTO osm VALUES (?, ?)', osm_rows)
+    self.cursor.executemany('INSERT OR REPLACE INTO geometries (element, s, w, n, e) VALUES (?, ?, ?, ?, ?)', geometry_rows)
+    self.commit_changes()
+    return len(osm_rows)
+
+  def get_names(self):
+    self.cursor.execute('SELECT name FROM names ORDER BY id')
+    return [r[0] for r in self.cursor.fetchall()]
 
   def find_names(self, prefix):
     self.cursor.execute(
-        'SELECT * FROM names WHERE name LIKE ?', (prefix + '%', ))
+        'SELECT name FROM names WHERE name LIKE ? ORDER BY id', (prefix + '%', ))
     return list(map(lambda r: r[0], self.cursor.fetchall()))
 
-  def get_rowid(self, name):
-    self.cursor.execute('SELECT rowid FROM names WHERE name = ?', (name, ))
-    return self.cursor.fetchone()[0]
+  def get_name_id(self, name):
+    self.cursor.execute('SELECT id FROM names WHERE name = ?', (name, ))
+    row = self.cursor.fetchone()
+    return None if row == None else row[0]
+
+  def get_all_elements(self):
+    self.cursor.execute('SELECT DISTINCT element FROM osm')
+    return [OSMElement(row[0] & 3, row[0] >> 2) for row in self.cursor.fetchall()]
 
-  def get_elements(self, name):
-    rowid = self.get_rowid(name)
-    self.cursor.execute(
-        'SELECT ref,type_code FROM osm WHERE names_rowid = ?', (rowid, ))
+  def get_geometries(self, elements):
+    keys = [e.id * 4 + e.type_id for e in elements]
+    geometries = {}
+    for i in range(0, len(keys), self.max_params):
+      batch = keys[i:i + self.max_params]
+      params = ','.join('?' * len(batch))
+      self.cursor.execute(f'SELECT element, s, w, n, e FROM geometries WHERE element IN ({params})', batch)
+      geometries.update(self._geometries(self.cursor.fetchall()))
+    return geometries
+
+  def _geometries(self, rows):
+    geometries = {}
+    for (element, s, w, n, e) in rows:
+      type_code = element & 3
+      reference = f'{OSMElement.type_names[type_code]}/{element >> 2}'
+      if type_code == 0:
+        geometries[reference] = [(s + n) / 2, (w + e) / 2]
+      else:
+        geometries[reference] = [s, w, n, e]
+    return geometries
+
+  def get_elements(self, name, bbox=None):
+    name_id = self.get_name_id(name)
+    if name_id == None:
+      return []
+    if bbox == None:
+      self.cursor.execute(
+          'SELECT element FROM osm WHERE name_id = ?', (name_id, ))
+    else:
+      # elements without stored geometry can't be excluded here
+      self.cursor.execute(
+          'SELECT o.element FROM osm o LEFT JOIN geometries g ON g.element = o.element ' +
+          'WHERE o.name_id = ? AND (g.element IS NULL OR (g.s <= ? AND g.n >= ? AND g.w <= ? AND g.e >= ?))',
+          (name_id, bbox.n, bbox.s, bbox.e, bbox.w))
     elements = []
     for row in self.cursor.fetchall():
-      element = OSMElement(row[1], row[0])
+      element = OSMElement(row[0] & 3, row[0] >> 2)
       elements.append(element)
-    return elements
\ No newline at end of file
+    return elements
+
+
+class OSMTileSet(Gazetteer):
+
+  def __init__(self, tile_dbs, tiles=[]):
+    self.tile_dbs = tile_dbs
+    self.tiles = tiles
+    self.created = time.time()
+    self.name_index = None
+    self.lock = threading.Lock()
+
+  def load_name_index(self):
+    names = {}
+    for db in self.tile_dbs:
+      names.update(dict.fromkeys(db.get_names()))
+    self.name_index = NameIndex(list(names))
+
+  @property
+  def names(self):
+    if self.name_index == None:
+      self.load_name_index()
+    return self.name_index.names
+
+  def matches_prefix(self, name, prefix):
+    return name.lower().startswith(prefix.lower())
+
+  def find_phrases(self, prefix):
+    if self.name_index != None:
+      return self.name_index.find_phrases(prefix)
+    return super().find_phrases(prefix)
+
+  def get_variants(self, name):
+    if self.name_index != None:
+      return self.name_index.get_variants(name)
+    return super().get_variants(name)
+
+  def get_shortened(self, short):
+    if self.name_index != None:
+      return self.name_index.get_shortened(short)
+    return super().get_shortened(short)
+
+  def get_folded(self, phrase):
+    if self.name_index != None:
+      return self.name_index.get_folded(phrase)
+    return super().get_folded(phrase)
+
+  def find_names(self, prefix):
+    if self.name_index != None:
+      return self.name_index.find_names(prefix)
+    names = {}
+    with self.lock:
+      for db in self.tile_dbs:
+        names.update(dict.fromkeys(db.find_names(prefix)))
+    return list(names)
+
+  def get_elements(self, name, bbox=None):
+    elements = {}
+    with self.lock:
+      for db in self.tile_dbs:
+        for e in db.get_elements(name, bbox):
+          elements[e.reference] = e
+    return list(elements.values())
+
+  def get_geometries(self, elements):
+    geometries = {}
+    with self.lock:
+      for db in self.tile_dbs:
+        geometries.update(db.get_geometries(elements))
+    return geometries
+
+  def get_all_elements(self):
+    elements = {}
+    with self.lock:
+      for db in self.tile_dbs:
+        for e in db.get_all_elements():
+          elements[e.reference] = e
+    return list(elements.values())
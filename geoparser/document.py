@@ -31,6 +31,7 @@ class Document:
   def __init__(self, text=''):
     self.text = text
     self.anns = {}
+    self.folded = None # (text, folded text) of the matchers
 
   def export_layers(self, only_layers=None):
     json_obj = {}
@@ -0,0 +1,224 @@
+import itertools
+import re
+from bisect import bisect_left
+from unidecode import unidecode
+
+
+class Gazetteer:
+
+  abbr = {
+    'N': 'North',
+    'N.': 'North',
+    'E': 'East',
+    'E.': 'East',
+    'S': 'South',
+    'S.': 'South',
+    'W': 'West',
+    'W.': 'West',
+    'NE': 'Northeast',
+    'SE': 'Southeast',
+    'SW': 'Southwest',
+    'NW': 'Northwest',
+    'N.E.': 'Northeast',
+    'S.E.': 'Southeast',
+    'S.W.': 'Southwest',
+    'N.W.': 'Northwest',
+    'Mt': 'Mount',
+    'Mt.': 'Mount',
+    'St': 'Saint',
+    'St.': 'Saint'
+  }
+
+  abbr_end = {
+    'St': 'Street',
+    'Ave': 'Avenue',
+    'Blvd': 'Boulevard',
+    'Fwy': 'Freeway',
+    'Pkwy': 'Parkway',
+    'Ln': 'Lane',
+    'Rd': 'Road',
+    'Dr': 'Drive',
+    'Sq': 'Square'
+  }
+
+  abbreviations = [(re.compile(l), s) for s, l in list(abbr.items()) + list(abbr_end.items())]
+  long_forms = re.compile('|'.join(set(abbr.values()) | set(abbr_end.values())))
+
+  ids = itertools.count()
+
+  id = None # identifies the gazetteer in process-wide caches
+  expanded = False
+  variants = None # name: abbreviated phrases, complete once expanded
+  shortened = None # abbreviated prefix: [(phrase, name)]
+  upper = None # name: upper-case phrase
+  folded = None # phrase: folded phrase
+
+  def find_names(self, prefix):
+    return []
+
+  def get_id(self):
+    if self.id == None:
+      self.id = next(Gazetteer.ids)
+    return self.id
+
+  def expand(self, names):
+    self.variants = {}
+    self.folded = {}
+    for name in names:
+      self.get_folded(name)
+      if self.long_forms.search(name) != None:
+        self.variants[name] = self._abbreviate(name)
+        for phrase in self.variants[name]:
+          self.get_folded(phrase)
+    self.shortened = {}
+    for short in self.abbr:
+      for phrase, _, _ in self.get_shortened(short):
+        self.get_folded(phrase)
+    self.expanded = True
+
+  def find_phrases(self, prefix):
+    phrases = []
+    for name in self.find_names(prefix):
+      phrases.append((name, self.get_folded(name), name))
+      for phrase in self.get_variants(name):
+        if phrase.startswith(prefix):
+          phrases.append((phrase, self.get_folded(phrase), name))
+    if prefix in self.abbr:
+      phrases += self.get_shortened(prefix)
+    elif prefix.isupper() and len(prefix) > 2:
+      prefix_title = prefix[0] + prefix[1:].lower()
+      for name in self.find_names(prefix_title):
+        phrase = self.get_upper(name)
+        phrases.append((phrase, self.get_folded(phrase), name))
+    return phrases
+
+  def get_variants(self, name):
+    if self.variants == None:
+      self.variants = {}
+    if name not in self.variants:
+      if self.expanded:
+        return []
+      self.variants[name] = self._abbreviate(name)
+    return self.variants[name]
+
+  def get_shortened(self, short):
+    if self.shortened == None:
+      self.shortened = {}
+    if short not in self.shortened:
+      long = self.abbr[short]
+      phrases = [(n.replace(long, short), n) for n in self.find_names(long)]
+      self.shortened[short] = [(p, self.get_folded(p), n) for p, n in phrases if ' ' in p]
+    return self.shortened[short]
+
+  def get_upper(self, name):
+    if self.upper == None:
+      self.upper = {}
+    if name not in self.upper:
+      self.upper[name] = name.upper()
+    return self.upper[name]
+
+  def get_folded(self, phrase):
+    if self.folded == None:
+      self.folded = {}
+    if phrase not in self.folded:
+      self.folded[phrase] = fold_phrase(phrase)
+    return self.folded[phrase]
+
+  def _abbreviate(self, name):
+    phrases = []
+    for regex, repl in self.abbreviations:
+      phrase = regex.sub(repl, name)
+      if phrase != name:
+        phrases.append(phrase)
+    return phrases
+
+
+class NameIndex(Gazetteer):
+
+  def __init__(self, names):
+    self.names = list(names)
+    # sorted by case-folded name (like SQLite's LIKE), rank keeps insert order
+    entries = sorted((n.lower(), rank, n) for rank, n in enumerate(self.names))
+    self.keys = [e[0] for e in entries]
+    self.entries = [(e[1], e[2]) for e in entries]
+    self.expand(self.names)
+
+  def __len__(self):
+    return len(self.keys)
+
+  def find_names(self, prefix):
+    key = prefix.lower()
+    start = bisect_left(self.keys, key)
+    end = bisect_left(self.keys, key + '\U0010ffff', start)
+    found = sorted(self.entries[start:end])
+    return [name for _, name in found]
+
+  def matches_prefix(self, name, prefix):
+    return name.lower().startswith(prefix.lower())
+
+
+class PrefixTree(Gazetteer):
+
+  def __init__(self, names, key_length=2):
+    self.names = list(names)
+    self.key_length = key_length
+    self.tree = {}
+    for name in self.names:
+      key = name[:key_length]
+      if key not in self.tree:
+        self.tree[key] = []
+      self.tree[key].append(name)
+    self.expand(self.names)
+
+  def __len__(self):
+    return len(self.names)
+
+  def find_names(self, prefix):
+    key = prefix[:self.key_length]
+    if key not in self.tree:
+      return []
+    return [n for n in self.tree[key] if n.startswith(prefix)]
+
+  def matches_prefix(self, name, prefix):
+    return name[:self.key_length] == prefix[:self.key_length] and name.startswith(prefix)
+
+
+folded_chars = {}
+accepted = {}
+unfoldable = set() # accepted in place of characters that fold differently
+
+def fold_text(text):
+  # one folded character per character, so that offsets stay the same
+  return ''.join([folded_chars.get(c) or _fold_char(c) for c in text])
+
+def fold_phrase(phrase):
+  for char in phrase:
+    accepted_chars(char)
+  return fold_text(phrase)
+
+def _fold_char(char):
+  folded = None
+  for form in [char, char.upper(), char.casefold()]:
+    asc = unidecode(form)
+    if len(asc) == 1:
+      folded = asc.lower()
+      break
+  if folded == None:
+    folded = char.casefold()
+    if len(folded) != 1:
+      folded = char
+  folded_chars[char] = folded
+  return folded
+
+def accepted_chars(char):
+  if char not in accepted:
+    chars = {char, char.upper()}
+    asc = unidecode(char)
+    if len(asc) == 1:
+      chars.add(asc)
+      chars.add(asc.upper())
+    folded = fold_text(char)
+    if any(len(c) == 1 and fold_text(c) != folded for c in chars):
+      unfoldable.add(char)
+    accepted[char] = chars
+  return accepted[char]
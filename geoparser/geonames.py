@@ -64,8 +64,14 @@ class GeoName:
     return f'{self.toponym_name}, {self.adm1}, {self.cc} [{self.fcode}]'
 
 
+class GeoNamesException(Exception):
+  pass
+
+
 class GeoNamesAPI:
 
+  timeout = 15 # seconds
+
   @staticmethod
   def search(name, feature_classes):
     params = [('q', name)]
@@ -77,10 +83,28 @@ class GeoNamesAPI:
     json_array = json_data['geonames']
     return list(map(GeoName, json_array))
 
+  @staticmethod
+  def get_cities(min_population, country_code=None):
+    # the API pages results in up to 1000 rows and stops at row 5000
+    cities = []
+    for start_row in range(0, 5000, 1000):
+      params = [('featureClass', 'P'), ('orderby', 'population'),
+                ('maxRows', 1000), ('startRow', start_row)]
+      if country_code != None:
+        params.append(('country', country_code))
+      json_data = GeoNamesAPI.get_json('search', params)
+      page = list(map(GeoName, json_data.get('geonames', [])))
+      cities += [g for g in page if g.population >= min_population]
+      if len(page) < 1000 or page[-1].population < min_population:
+        break
+    return cities
+
   @staticmethod
   def get_hierarchy(id):
     params = [('geonameId', id)]
     json_data = GeoNamesAPI.get_json('hierarchy', params)
+    if not 'geonames' in json_data:
+      raise GeoNamesException(f'no hierarchy for {id}')
     json_array = json_data['geonames']
     return list(map(GeoName, json_array))
 
@@ -97,13 +121,23 @@ class GeoNamesAPI:
   def get_geoname(id):
     params = [('geonameId', id)]
     json_data = GeoNamesAPI.get_json('get', params)
-    return GeoName(json_data)
+    try:
+      return GeoName(json_data)
+    except KeyError:
+      raise GeoNamesException(f'malformed GeoName {id}')
 
   @staticmethod
   def get_json(endpoint, params):
     url = f'http://api.geonames.org/{endpoint}JSON?username=map2txt'
     for key, value in params:
       url += f'&{key}={value}'
-    res = requests.get(url=url)
-    res.encoding = 'utf-8'
-    return res.json()
+    try:
+      res = requests.get(url=url, timeout=GeoNamesAPI.timeout)
+      res.encoding = 'utf-8'
+      json_data = res.json()
+    except (requests.RequestException, ValueError) as e:
+      raise GeoNamesException(f'{endpoint} request failed: {e}')
+    if 'status' in json_data:
+      # e.g. exceeded rate limits
+      raise GeoNamesException(f'{endpoint} request failed: {json_data["status"]["message"]}')
+    return json_data
@@ -0,0 +1,112 @@
+import os
+import time
+from .datastore import Datastore
+
+
+class GeoNamesDumpImporter:
+
+  batch_size = 50000
+  # pseudo language codes that do not hold names
+  excluded_languages = ['link', 'wkdt', 'post', 'iata', 'icao', 'faac', 'unlc', 'fr_1793']
+
+  def import_dump(self, dump_dir):
+    # expects the files from https://download.geonames.org/export/dump/
+    geonames_path = f'{dump_dir}/allCountries.txt'
+    alt_names_path = f'{dump_dir}/alternateNamesV2.txt'
+    if not os.path.exists(alt_names_path):
+      alt_names_path = f'{dump_dir}/alternateNames.txt'
+    hierarchy_path = f'{dump_dir}/hierarchy.txt'
+
+    db = Datastore._geonames_db()
+    db.cursor.execute('PRAGMA synchronous = OFF')
+    db.create_dump_tables()
+
+    self._import_geonames(db, geonames_path)
+    if os.path.exists(alt_names_path):
+      self._import_alternate_names(db, alt_names_path)
+    if os.path.exists(hierarchy_path):
+      self._import_hierarchy(db, hierarchy_path)
+
+    print('building indices ...')
+    db.create_dump_indices()
+    db.commit_changes()
+
+  def _import_geonames(self, db, path):
+    geoname_rows = []
+    admin_rows = []
+    name_rows = []
+
+    def flush():
+      db.store_dump_geonames(geoname_rows, admin_rows, name_rows)
+      geoname_rows.clear()
+      admin_rows.clear()
+      name_rows.clear()
+
+    count = self._read(path, lambda c: self._add_geoname(c, geoname_rows, admin_rows, name_rows),
+                       lambda: len(geoname_rows) >= self.batch_size, flush)
+    print(f'imported {count} geonames')
+
+  def _add_geoname(self, cols, geoname_rows, admin_rows, name_rows):
+    geoname_id = int(cols[0])
+    name = cols[1]
+    population = int(cols[14] or 0)
+    fcl = cols[6] or '-'
+    fcode = cols[7] or '-'
+    cc = cols[8] or '-'
+    adm1 = cols[10] or '-'
+    geoname_rows.append((geoname_id, name, population, float(cols[4]), float(cols[5]),
+                         fcl, fcode, cc, adm1, name))
+    admin_rows.append((geoname_id, fcode, cols[8], cols[10], cols[11], cols[12], cols[13]))
+    keys = {name.lower(), cols[2].lower()}
+    for key in keys:
+      name_rows.append((key, geoname_id))
+
+  def _import_alternate_names(self, db, path):
+    name_rows = []
+    display_names = []
+
+    def add(cols):
+      if cols[2] in self.excluded_languages:
+        return
+      geoname_id = int(cols[1])
+      name_rows.append((cols[3].lower(), geoname_id))
+      if cols[2] == 'en' and cols[4] == '1':
+        display_names.append((cols[3], geoname_id))
+
+    def flush():
+      db.store_dump_names(name_rows, display_names)
+      name_rows.clear()
+      display_names.clear()
+
+    count = self._read(path, add, lambda: len(name_rows) >= self.batch_size, flush)
+    print(f'imported {count} alternate names')
+
+  def _import_hierarchy(self, db, path):
+    parent_rows = []
+
+    def add(cols):
+      if cols[2] == 'ADM':
+        parent_rows.append((int(cols[0]), int(cols[1])))
+
+    def flush():
+      db.store_dump_parents(parent_rows)
+      parent_rows.clear()
+
+    count = self._read(path, add, lambda: len(parent_rows) >= self.batch_size, flush)
+    print(f'imported {count} hierarchy relations')
+
+  def _read(self, path, add, is_full, flush):
+    start_time = time.time()
+    count = 0
+    with open(path, encoding='utf-8') as f:
+      for line in f:
+        cols = line.rstrip('\n').split('\t')
+        add(cols)
+        count += 1
+        if is_full():
+          flush()
+        if count % 1000000 == 0:
+          rate = count / (time.time() - start_time)
+          print(f'{path}: {count} rows ({rate:.0f} rows/s)')
+    flush()
+    return count
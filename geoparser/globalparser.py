@@ -4,6 +4,7 @@ from .datastore import Datastore
 from .document import Layer
 from .pipeline import Step
 from .matcher import NameMatcher
+from .gazetteer import PrefixTree
 from .admtree import GeoNamesTree
 from .util import GeoUtil
 
@@ -35,12 +36,7 @@ class GlobalGeoparser(Step):
     self.top_level_topos.update(continents)
     self.top_level_topos.update(oceans)
 
-    self.lookup_tree = {}
-    for toponym in self.top_level_topos:
-      key = toponym[:2]
-      if key not in self.lookup_tree:
-        self.lookup_tree[key] = []
-      self.lookup_tree[key].append(toponym)
+    self.gazetteer = PrefixTree(self.top_level_topos)
 
     self.candidates = {}
 
@@ -91,13 +87,6 @@ class GlobalGeoparser(Step):
   def _find_missed_top_levels(self, doc, resolutions):
     topo_indices = doc.annotations_by_index(Layer.topo)
 
-    def lookup(prefix):
-      key = prefix[:2]
-      if key not in self.lookup_tree:
-        return []
-      toponyms = self.lookup_tree[key]
-      return [t for t in toponyms if t.startswith(prefix)]
-
     def commit(c):
       indices = range(c.pos, c.end)
       overlaps = [i for i in topo_indices if i in indices]
@@ -107,7 +96,7 @@ class GlobalGeoparser(Step):
       resolutions[c.match] = Datastore.get_geoname(geoname_id)
       return True
 
-    self.matcher.find_matches(doc, lookup, commit)
+    self.matcher.find_matches(doc, self.gazetteer, commit)
 
   def _select_heuristically(self, toponym, current, tree):
     results = Datastore.search_geonames(toponym)
@@ -1,8 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
 from .datastore import Datastore
 from .document import Layer
 from .pipeline import Step
-from .matcher import NameMatcher
+from .matcher import NameMatcher, AutomatonMatcher
 from .admtree import GeoNamesTree
+from .geonames import GeoNamesException
 from .osm import OverpassAPI
 from .util import BoundingBox, GeoUtil
 
@@ -12,8 +14,13 @@ class LocalGeoparser(Step):
   key = 'local'
   layers = [Layer.lres]
 
-  def __init__(self):
-    self.matcher = NameMatcher()
+  matchers = {'names': NameMatcher, 'automaton': AutomatonMatcher}
+
+  def __init__(self, matcher='names', single_pass=False):
+    if matcher not in self.matchers:
+      raise ValueError(f'Invalid matcher: {matcher}')
+    self.matcher = self.matchers[matcher]()
+    self.single_pass = single_pass
 
   def annotate(self, doc):
     resolutions = {}
@@ -23,20 +30,96 @@ class LocalGeoparser(Step):
     tree = GeoNamesTree(resolutions)
 
     entity_indicies = doc.annotations_by_index(Layer.ner)
+    anchors = self._collect_anchors(tree)
+    if len(anchors) == 0:
+      return
+
+    # matches are annotated first, their geometries are then resolved at once
+    osm_dbs = []
+    commit_matches = []
+    matched_elements = {} # pos: (osm elements, search area)
+
+    # download the OSM data of all anchors in parallel, but match in order
+    workers = min(Datastore.osm_load_workers, len(anchors))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+      futures = [executor.submit(Datastore.load_osm_database, a) for a in anchors]
+      for anchor, future in zip(anchors, futures):
+        print(f'lres - anchor: {anchor}')
+        db = future.result()
+        osm_dbs.append(db)
+        commit_match = self._match_committer(doc, anchor, db, entity_indicies, matched_elements)
+        if self.single_pass:
+          commit_matches.append(commit_match)
+        else:
+          self.matcher.find_matches(doc, db, commit_match)
+
+    if self.single_pass:
+      # one scan for all anchors, matches are committed as with one pass per anchor
+      self.matcher.find_merged_matches(doc, osm_dbs, commit_matches)
+
+    all_elements = {e.reference: e for els, _ in matched_elements.values() for e in els}
+    geometries = Datastore.load_osm_geometries(list(all_elements.values()), osm_dbs)
+    for pos, (osm_elements, area) in matched_elements.items():
+      ann = doc.get(Layer.lres, pos)
+      if ann == None or ann.group != 'local':
+        continue # replaced by a later match
+      data = self._annotation_data(osm_elements, geometries, area)
+      if data == None:
+        doc.delete_annotation(Layer.lres, pos) # no geometries available
+      else:
+        doc.update_annotation(Layer.lres, pos, 'local', data)
+
+  def _match_committer(self, doc, anchor, db, entity_indicies, matched_elements):
+    elements_cache = {}
+    # tiles reach beyond the area around the anchor
+    area = GeoUtil.bounding_box(anchor.lat, anchor.lon, Datastore.osm_search_dist)
+
+    def commit_match(c):
+      if c.match.isnumeric():
+        return False
+      replace_identical = False
+      if c.pos in entity_indicies:
+        ent_ann = entity_indicies[c.pos]
+        if len(ent_ann.phrase) > len(c.match):
+          return True # part of entity name
+        prev_ann = doc.get(Layer.lres, ent_ann.pos)
+        if prev_ann != None:
+          if prev_ann.group == 'local':
+            return True # already annotated locally
+          geoname_id = prev_ann.data[2]
+          if geoname_id == anchor.id:
+            return True # anchor itself
+          geoname = Datastore.get_geoname(geoname_id)
+          if geoname.char_match(c.match):
+            return True # exact global resolution
+          replace_identical = True
+      if c.lookup_phrase not in elements_cache:
+        elements_cache[c.lookup_phrase] = db.get_elements(c.lookup_phrase, area)
+      if len(elements_cache[c.lookup_phrase]) == 0:
+        return False # only outside of the area around the anchor
+      print(f'lres - local match: {c.match}')
+      if doc.annotate(Layer.lres, c.pos, c.match, 'local', None, replace_shorter=True, replace_identical=replace_identical):
+        matched_elements[c.pos] = (elements_cache[c.lookup_phrase], area)
+      return True
+
+    return commit_match
+
+  def _collect_anchors(self, tree):
+    anchors = []
     parsed = {}
 
     for leaf in tree.leafs():
       geonames = leaf.geonames.values()
-      anchors = [g for g in geonames if g.is_city]
+      leaf_anchors = [g for g in geonames if g.is_city]
 
-      if len(anchors) == 0:
+      if len(leaf_anchors) == 0:
         smallest = min(geonames, key=lambda g: g.population)
         anchor = self._find_city_child(smallest)
         if anchor != None:
-          anchors.append(anchor)
+          leaf_anchors.append(anchor)
 
-      anchors = sorted(anchors, key=lambda g: -g.population)
-      for anchor in anchors:
+      leaf_anchors = sorted(leaf_anchors, key=lambda g: -g.population)
+      for anchor in leaf_anchors:
         if anchor.id in parsed:
           continue
 
@@ -50,40 +133,9 @@ class LocalGeoparser(Step):
           continue
 
         parsed[anchor.id] = [anchor.lat, anchor.lon]
-        print(f'lres - anchor: {anchor}')
-        db = Datastore.load_osm_database(anchor)
-        data_cache = {}
-
-        def commit_match(c):
-          if c.match.isnumeric():
-            return False
-          replace_identical = False
-          if c.pos in entity_indicies:
-            ent_ann = entity_indicies[c.pos]
-            if len(ent_ann.phrase) > len(c.match):
-              return True # part of entity name
-            prev_ann = doc.get(Layer.lres, ent_ann.pos)
-            if prev_ann != None:
-              if prev_ann.group == 'local':
-                return True # already annotated locally
-              geoname_id = prev_ann.data[2]
-              if geoname_id == anchor.id:
-                return True # anchor itself
-              geoname = Datastore.get_geoname(geoname_id)
-              if geoname.char_match(c.match):
-                return True # exact global resolution
-              replace_identical = True
-          print(f'lres - local match: {c.match}')
-          if c.lookup_phrase in data_cache:
-            data = data_cache[c.lookup_phrase]
-          else:
-            osm_elements = db.get_elements(c.lookup_phrase)
-            data = self._annotation_data(osm_elements)
-            data_cache[c.lookup_phrase] = data
-          doc.annotate(Layer.lres, c.pos, c.match, 'local', data, replace_shorter=True, replace_identical=replace_identical)
-          return True
-
-        self.matcher.find_matches(doc, db.find_names, commit_match)
+        anchors.append(anchor)
+
+    return anchors
 
   def _find_city_child(self, geoname):
     hierarchy = Datastore.get_hierarchy(geoname.id)
@@ -91,7 +143,10 @@ class LocalGeoparser(Step):
       return None
 
     while True:
-      children = Datastore.get_children(geoname.id)
+      try:
+        children = Datastore.get_children(geoname.id)
+      except GeoNamesException:
+        return None
 
       if len(children) == 0:
         # if there's nothing below, assume we are already local
@@ -106,8 +161,17 @@ class LocalGeoparser(Step):
 
       return None
 
-  def _annotation_data(self, osm_elements):
-    geoms = Datastore.load_osm_geometries(osm_elements)
+  def _annotation_data(self, osm_elements, geometries, area):
+    geoms = {'node': {}, 'way': {}, 'relation': {}}
+    in_area = []
+    for e in osm_elements:
+      geom = geometries[e.type_name].get(e.id)
+      if geom == None:
+        continue
+      bbox = BoundingBox(*geom) if len(geom) == 4 else BoundingBox(*geom, *geom)
+      if GeoUtil.bounding_boxes_intersect(bbox, area):
+        geoms[e.type_name][e.id] = geom
+        in_area.append(e)
 
     bboxes = [BoundingBox(*geom) for geom in geoms['relation'].values()]
     coords = []
@@ -124,8 +188,11 @@ class LocalGeoparser(Step):
       if not self._point_in_boxes(bbox.center_lat, bbox.center_lon, bboxes):
         coords.append((bbox.center_lat, bbox.center_lon))
 
+    if len(coords) == 0:
+      return None
+
     (avg_lat, avg_lon) = GeoUtil.average_coord(coords)
-    osm_refs = [e.reference for e in osm_elements]
+    osm_refs = [e.reference for e in in_area]
 
     return [avg_lat, avg_lon, osm_refs]
 
@@ -1,58 +1,21 @@
 import re
-from unidecode import unidecode
+import threading
+import weakref
+from bisect import bisect_left
+from .datastore import Datastore
+from .gazetteer import fold_text, fold_phrase, accepted_chars, unfoldable
 
 
 class NameMatcher:
 
-  abbr = {
-    'N': 'North',
-    'N.': 'North',
-    'E': 'East',
-    'E.': 'East',
-    'S': 'South',
-    'S.': 'South',
-    'W': 'West',
-    'W.': 'West',
-    'NE': 'Northeast',
-    'SE': 'Southeast',
-    'SW': 'Southwest',
-    'NW': 'Northwest',
-    'N.E.': 'Northeast',
-    'S.E.': 'Southeast',
-    'S.W.': 'Southwest',
-    'N.W.': 'Northwest',
-    'Mt': 'Mount',
-    'Mt.': 'Mount',
-    'St': 'Saint',
-    'St.': 'Saint'
-  }
-
-  abbr_end = {
-    'St': 'Street',
-    'Ave': 'Avenue',
-    'Blvd': 'Boulevard',
-    'Fwy': 'Freeway',
-    'Pkwy': 'Parkway',
-    'Ln': 'Lane',
-    'Rd': 'Road',
-    'Dr': 'Drive',
-    'Sq': 'Square'
-  }
-
   def __init__(self):
     self.starts = re.compile('\\b[A-Z0-9]')
-    self.abbreviations = []
-    for s, l in self.abbr.items():
-      self.abbreviations.append((re.compile(l), s))
-    for s, l in self.abbr_end.items():
-      self.abbreviations.append((re.compile(l), s))
 
-  def find_matches(self, doc, lookup_prefix, commit_match):
+  def find_matches(self, doc, gazetteer, commit_match):
     text = doc.text + ' '  # allow matching of last token
-    text_len = len(text)
+    folded = fold_document(doc)
 
     prev_end = 0
-    saved = {}
 
     for m in self.starts.finditer(doc.text):
       start = m.start()
@@ -60,101 +23,244 @@ class NameMatcher:
         continue
 
       prefix = text[start:start+4].split(' ')[0]
+      prev_end = start + len(prefix)
 
-      if prefix in saved:
-        completions = [c.clone(start) for c in saved[prefix]]
-      else:
-        completions = self._get_completions(prefix, lookup_prefix, start)
-        saved[prefix] = completions
-
-      text_pos = start + len(prefix)
-      prev_end = text_pos
-      longest_compl = None
-      while text_pos < text_len and len(completions) > 0:
-        next_char = text[text_pos]
-        for c in completions:
-          complete = c.trim(next_char)
-          if complete:
-            longest_compl = c
-        completions = [c for c in completions if c.active]
-        text_pos += 1
-
+      longest_compl = self._longest_completions(text, folded, prefix, start, [gazetteer]).get(0)
       if longest_compl != None:
+        longest_compl.match = text[longest_compl.pos:longest_compl.end]
         if commit_match(longest_compl):
           prev_end = longest_compl.end
 
-  def _get_completions(self, prefix, lookup_prefix, pos):
-    found_names = lookup_prefix(prefix)
-    completions = []
-    for db_name in found_names:
-      compl = Completion(db_name, prefix, db_name, pos)
-      completions.append(compl)
-      for regex, repl in self.abbreviations:
-        phrase = regex.sub(repl, db_name)
-        if phrase != db_name and phrase.startswith(prefix):
-          short_compl = Completion(phrase, prefix, db_name, pos)
-          completions.append(short_compl)
-    if prefix in self.abbr:
-      long_prefix = self.abbr[prefix]
-      found_names = lookup_prefix(long_prefix)
-      for db_name in found_names:
-        phrase = db_name.replace(long_prefix, prefix)
-        if ' ' not in phrase:
+  def find_merged_matches(self, doc, gazetteers, commit_matches):
+    # scans once for all gazetteers, then commits the matches of one gazetteer
+    # after the other, so that the result is the same as with one pass each
+    text = doc.text + ' '  # allow matching of last token
+    folded = fold_document(doc)
+
+    candidates = [] # (start, prefix length, {source: longest completion})
+    for m in self.starts.finditer(doc.text):
+      start = m.start()
+      prefix = text[start:start+4].split(' ')[0]
+      longest_compls = self._longest_completions(text, folded, prefix, start, gazetteers)
+      candidates.append((start, len(prefix), longest_compls))
+
+    for source, commit_match in enumerate(commit_matches):
+      prev_end = 0
+      for start, prefix_len, longest_compls in candidates:
+        if start < prev_end:
           continue
-        long_compl = Completion(phrase, prefix, db_name, pos)
-        completions.append(long_compl)
-    elif prefix.isupper() and len(prefix) > 2:
+        prev_end = start + prefix_len
+        longest_compl = longest_compls.get(source)
+        if longest_compl != None:
+          longest_compl.match = text[longest_compl.pos:longest_compl.end]
+          if commit_match(longest_compl):
+            prev_end = longest_compl.end
+
+  def _longest_completions(self, text, folded, prefix, start, gazetteers):
+    text_len = len(text)
+    text_pos = start + len(prefix)
+    next_char = text[text_pos]
+    folded_char = folded[text_pos]
+
+    completions = []
+    for source, gazetteer in enumerate(gazetteers):
+      # completion templates are shared by all documents using the gazetteer
+      key = (gazetteer.get_id(), prefix)
+      templates = Datastore.completions.get(key)
+      if templates == None:
+        templates = self._get_completions(prefix, gazetteer)
+        Datastore.completions.put(key, templates)
+      # most templates fail on the first character, those are not cloned
+      completions += [c.clone(start, source) for c in templates if c.accepts(next_char, folded_char)]
+    longest_compls = {} # source: completion
+    while text_pos < text_len and len(completions) > 0:
+      next_char = text[text_pos]
+      folded_char = folded[text_pos]
+      for c in completions:
+        complete = c.trim(next_char, folded_char)
+        if complete:
+          longest_compls[c.source] = c
+      completions = [c for c in completions if c.active]
+      text_pos += 1
+
+    return longest_compls
+
+  def _get_completions(self, prefix, gazetteer):
+    phrases = gazetteer.find_phrases(prefix)
+    return [Completion(phrase, folded, prefix, name, None) for phrase, folded, name in phrases]
+
+
+class AutomatonMatcher(NameMatcher):
+
+  def __init__(self):
+    super().__init__()
+    self.automata = weakref.WeakKeyDictionary() # gazetteer: PhraseAutomaton
+    self.lock = threading.Lock()
+
+  def _longest_completions(self, text, folded, prefix, start, gazetteers):
+    longest_compls = {} # source: completion
+    for source, gazetteer in enumerate(gazetteers):
+      automaton = self.get_automaton(gazetteer)
+      longest_compl = automaton.longest_completion(text, folded, prefix, start)
+      if longest_compl != None:
+        longest_compl.source = source
+        longest_compls[source] = longest_compl
+    return longest_compls
+
+  def get_automaton(self, gazetteer):
+    with self.lock:
+      if gazetteer not in self.automata:
+        self.automata[gazetteer] = PhraseAutomaton(gazetteer)
+      return self.automata[gazetteer]
+
+
+class PhraseAutomaton:
+
+  # variants are kept in the order of NameMatcher._get_completions, the last
+  # of several equally long completions wins there
+  NAME = 0
+  ABBREVIATION = 1
+  SHORT_PREFIX = 2
+  UPPER = 3
+
+  def __init__(self, gazetteer):
+    self.gazetteer = gazetteer
+    self.abbr = gazetteer.abbr
+    self.phrases = {} # folded phrase: [(phrase, lookup phrase, kind, short, order)]
+
+    ranks = {}
+    for rank, name in enumerate(gazetteer.names):
+      ranks[name] = rank
+      self._add(name, name, self.NAME, None, (0, rank, 0))
+      for i, phrase in enumerate(gazetteer.get_variants(name)):
+        self._add(phrase, name, self.ABBREVIATION, None, (0, rank, i + 1))
+      self._add(name.upper(), name, self.UPPER, None, (1, rank, 0))
+    for short in self.abbr:
+      for phrase, _, name in gazetteer.get_shortened(short):
+        self._add(phrase, name, self.SHORT_PREFIX, short, (1, ranks[name], 0))
+
+    self.keys = sorted(self.phrases)
+
+  def __len__(self):
+    return len(self.keys)
+
+  def _add(self, phrase, lookup_phrase, kind, short, order):
+    if kind == self.UPPER:
+      key = fold_phrase(phrase) # not kept by the gazetteer
+    else:
+      key = self.gazetteer.get_folded(phrase)
+    if key not in self.phrases:
+      self.phrases[key] = []
+    self.phrases[key].append((phrase, lookup_phrase, kind, short, order))
+
+  def longest_completion(self, text, folded, prefix, pos):
+    keys = self.keys
+    lo, hi = 0, len(keys)
+    end = pos
+    longest_compl = None
+
+    # walk down the trie of folded phrases along the folded text
+    while end + 1 < len(folded) and lo < hi:
+      end += 1
+      key = folded[pos:end]
+      lo = bisect_left(keys, key, lo, hi)
+      hi = bisect_left(keys, key + '\U0010ffff', lo, hi)
+      if lo == hi or keys[lo] != key:
+        continue
+      char = text[end]
+      if char.isupper() or char.islower() or char == '-':
+        continue  # end in middle of token
+      found = [p for p in self.phrases[key] if self._accepts(p, text, prefix, pos)]
+      if len(found) > 0:
+        phrase, lookup_phrase, _, _, _ = max(found, key=lambda p: p[4])
+        longest_compl = Completion(phrase, key, prefix, lookup_phrase, pos)
+        longest_compl.complete(text[pos:end])
+
+    return longest_compl
+
+  def _accepts(self, candidate, text, prefix, pos):
+    phrase, lookup_phrase, kind, short, _ = candidate
+    if len(phrase) < len(prefix):
+      return False
+    if kind == self.NAME:
+      if not self.gazetteer.matches_prefix(lookup_phrase, prefix):
+        return False
+    elif kind == self.ABBREVIATION:
+      if not phrase.startswith(prefix) or not self.gazetteer.matches_prefix(lookup_phrase, prefix):
+        return False
+    elif kind == self.SHORT_PREFIX:
+      if prefix != short:
+        return False
+    else:
+      if prefix in self.abbr or not prefix.isupper() or len(prefix) < 3:
+        return False
       prefix_title = prefix[0] + prefix[1:].lower()
-      found_names = lookup_prefix(prefix_title)
-      for db_name in found_names:
-        phrase = db_name.upper()
-        upper_compl = Completion(phrase, prefix, db_name, pos)
-        completions.append(upper_compl)
-    return completions
+      if not self.gazetteer.matches_prefix(lookup_phrase, prefix_title):
+        return False
+    for i in range(len(prefix), len(phrase)):
+      char = text[pos + i]
+      if char != phrase[i] and char not in accepted_chars(phrase[i]):
+        return False
+    return True
+
+
+def fold_document(doc):
+  # folded once per text and shared by all matchers of the document
+  if doc.folded == None or doc.folded[0] is not doc.text:
+    doc.folded = (doc.text, fold_text(doc.text + ' '))
+  return doc.folded[1]
 
 
 class Completion:
 
-  def __init__(self, phrase, prefix, lookup_phrase, pos):
+  __slots__ = ['phrase', 'folded', 'prefix', 'lookup_phrase', 'pos', 'source',
+               'index', 'match', 'end', 'active']
+
+  def __init__(self, phrase, folded, prefix, lookup_phrase, pos, source=0):
     self.phrase = phrase
+    self.folded = folded
     self.prefix = prefix
     self.lookup_phrase = lookup_phrase
     self.pos = pos
+    self.source = source # index of the gazetteer
 
-    self.suffix = phrase[len(prefix):]
-    self.match = prefix
+    self.index = len(prefix) # next character of the phrase to match
+    self.match = None # sliced from the text when committed
     self.end = None
     self.active = True
 
   def __repr__(self):
-    return self.suffix if self.active else self.match
+    return self.phrase[self.index:] if self.active else self.match
 
-  def clone(self, pos):
-    return Completion(self.phrase, self.prefix, self.lookup_phrase, pos)
+  def clone(self, pos, source=0):
+    return Completion(self.phrase, self.folded, self.prefix, self.lookup_phrase, pos, source)
 
-  def trim(self, char):
+  def complete(self, match):
+    self.index = len(match)
+    self.match = match
+    self.end = self.pos + len(match)
+    self.active = False
 
-    if self.suffix == '':
+  def accepts(self, char, folded_char):
+    if self.index >= len(self.phrase):
+      return not (char.isupper() or char.islower() or char == '-')  # end in middle of token
+
+    # the folded forms only rule out characters, the phrase decides on case
+    n = self.phrase[self.index]
+    return char == n or ((folded_char == self.folded[self.index] or n in unfoldable)
+                         and char in accepted_chars(n))
+
+  def trim(self, char, folded_char):
+    accepted = self.accepts(char, folded_char)
+
+    if self.index >= len(self.phrase):
       self.active = False
-      if char.isupper() or char.islower() or char == '-':
-        return False  # end in middle of token
-      else:
-        self.end = self.pos + len(self.match)
-        return True
-
-    n = self.suffix[0]
-    nu = n.upper()
-    accepted = [n, nu]
-    asc = unidecode(n)
-    if len(asc) == 1:
-      accepted.append(asc)
-      accepted.append(asc.upper())
-
-    if char in accepted:
-      self.suffix = self.suffix[1:]
-      self.match += char
-      return False
+      if accepted:
+        self.end = self.pos + self.index
+      return accepted
 
+    if accepted:
+      self.index += 1
     else:
       self.active = False
-      return False
+    return False
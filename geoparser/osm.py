@@ -1,7 +1,5 @@
 import requests
-import csv
 import json
-import io
 
 class OSMElement:
 
@@ -16,24 +14,57 @@ class OSMElement:
   def __repr__(self):
     return self.reference
 
+class OverpassException(Exception):
+  pass
+
+
 class OverpassAPI:
 
+  timeout = 300 # seconds
+  name_keys = ['name', 'name:en', 'alt_name', 'short_name', 'ref']
+
   @staticmethod
   def load_names_in_bounding_box(bbox, excluded_keys):
     exclusions = ''.join('[!"' + e + '"]' for e in excluded_keys)
 
-    query = '[out:csv(::id, ::type, "name", "name:en", "alt_name", "short_name", "ref"; false)]; ('
+    query = '[out:json]; ('
     query += f'node["name"]{exclusions}({bbox}); '
     query += f'way["name"]{exclusions}({bbox}); '
     query += f'rel["name"]{exclusions}({bbox}); '
     query += f'way[!"name"]["ref"]({bbox}); '  # include highway names
-    query += '); out qt;'
-    
+    query += ')->.named; node.named; out skel qt; (way.named; rel.named;); out ids bb qt; '
+    # only the name tags, as derived elements with the type and id of their source
+    name_tags = ''.join(f', "{k}" = t["{k}"]' for k in OverpassAPI.name_keys)
+    query += f'.named convert names ::id = id(), "type" = type(){name_tags}; out;'
+
     response = OverpassAPI.post_query(query)
-    # universal newlines mode
-    csv_input = io.StringIO(response.text, newline=None)
-    reader = csv.reader(csv_input, delimiter='\t')
-    return reader
+    try:
+      data = response.json()
+      elements = data['elements']
+    except (ValueError, KeyError):
+      raise OverpassException('malformed name response')
+
+    bounds = {}
+    names = {}
+    for e in elements:
+      if e['type'] == 'names':
+        tags = e.get('tags', {})
+        names[(tags.get('type'), int(e['id']))] = [tags.get(k, '') for k in OverpassAPI.name_keys]
+      elif e['type'] == 'node':
+        bounds[('node', e['id'])] = [e['lat'], e['lon'], e['lat'], e['lon']]
+      elif 'bounds' in e:
+        b = e['bounds']
+        bounds[(e['type'], e['id'])] = [b['minlat'], b['minlon'], b['maxlat'], b['maxlon']]
+      # else relation without members
+
+    # rows: id, type, center lat, center lon, names..., bounds (s, w, n, e)
+    rows = []
+    for (type_name, el_id), b in bounds.items():
+      if (type_name, el_id) not in names:
+        continue
+      center = [(b[0] + b[2]) / 2, (b[1] + b[3]) / 2]
+      rows.append([el_id, type_name, *center, *names[(type_name, el_id)], *b])
+    return rows
 
   @staticmethod
   def load_geometries(elements):
@@ -42,13 +73,22 @@ class OverpassAPI:
       query += f'{e.type_name}({e.id}); '
     query += '); out ids bb;'
     response = OverpassAPI.post_query(query)
-    data = response.json()
-    return data['elements']
+    try:
+      data = response.json()
+      return data['elements']
+    except (ValueError, KeyError):
+      raise OverpassException('malformed geometry response')
     
   @staticmethod
   def post_query(query):
     url = 'http://overpass-api.de/api/interpreter'
-    response = requests.post(url=url, data=query)
+    try:
+      response = requests.post(url=url, data=query, timeout=OverpassAPI.timeout)
+    except requests.RequestException as e:
+      raise OverpassException(f'request failed: {e}')
+    if response.status_code != 200:
+      # e.g. 429 for too many requests, 504 for server overload
+      raise OverpassException(f'request failed with status {response.status_code}')
     response.encoding = 'utf-8'
     return response
 
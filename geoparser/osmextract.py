@@ -0,0 +1,204 @@
+import os
+import bz2
+import sqlite3
+import tempfile
+import time
+import xml.etree.ElementTree as etree
+from .datastore import Datastore
+from .osm import OverpassAPI
+
+try:
+  import osmium
+except ImportError:
+  osmium = None
+
+
+class OSMExtractImporter:
+
+  batch_size = 10000
+  max_params = 900 # SQLite host parameter limit is 999
+
+  def __init__(self, overwrite=False):
+    self.overwrite = overwrite
+
+  def import_file(self, path):
+    # all nodes and way bounds are staged on disk to keep memory bounded
+    if not os.path.exists(Datastore.cache_dir):
+      os.mkdir(Datastore.cache_dir)
+    handle, staging_path = tempfile.mkstemp(suffix='.db', dir=Datastore.cache_dir)
+    os.close(handle)
+    self.staging = sqlite3.connect(staging_path)
+    self.staging.execute('PRAGMA synchronous = OFF')
+    self.staging.execute('PRAGMA journal_mode = OFF')
+    self.staging.execute('CREATE TABLE nodes (id INTEGER PRIMARY KEY, lat REAL, lon REAL)')
+    self.staging.execute('CREATE TABLE ways (id INTEGER PRIMARY KEY, s REAL, w REAL, n REAL, e REAL)')
+    self.staging.execute('CREATE TABLE elements (y INT, x INT, id INT, type TEXT, lat REAL, lon REAL, ' +
+                         'name TEXT, name_en TEXT, alt_name TEXT, short_name TEXT, ref TEXT, ' +
+                         's REAL, w REAL, n REAL, e REAL, large INT)')
+
+    self.tiles = set()
+    self.node_batch = []
+    self.way_batch = []
+    self.element_batch = []
+    self.node_count = 0
+    self.start_time = time.time()
+
+    try:
+      if '.pbf' in path:
+        self._read_pbf(path)
+      else:
+        self._read_xml(path)
+      self._flush()
+      self._build_tiles()
+    finally:
+      self.staging.close()
+      os.remove(staging_path)
+
+  def add_node(self, node_id, lat, lon, tags):
+    self.node_batch.append((node_id, lat, lon))
+    self.tiles.add(Datastore.osm_tile(lat, lon))
+    if self._is_included(tags, False):
+      self._add_element(node_id, 'node', (lat, lon, lat, lon), tags)
+
+    self.node_count += 1
+    if len(self.node_batch) >= self.batch_size:
+      self._flush()
+    if self.node_count % 1000000 == 0:
+      rate = self.node_count / (time.time() - self.start_time)
+      print(f'read {self.node_count} nodes ({rate:.0f} nodes/s)')
+
+  def add_way(self, way_id, node_refs, tags):
+    if len(self.node_batch) > 0:
+      self._flush()
+    bounds = self._bounds('SELECT min(lat), min(lon), max(lat), max(lon) FROM nodes', node_refs)
+    if bounds == None:
+      return
+    self.way_batch.append((way_id, *bounds))
+    if self._is_included(tags, True):
+      self._add_element(way_id, 'way', bounds, tags)
+    if len(self.way_batch) >= self.batch_size:
+      self._flush()
+
+  def add_relation(self, relation_id, members, tags):
+    if not self._is_included(tags, False):
+      return
+    if len(self.way_batch) > 0:
+      self._flush()
+    node_refs = [ref for t, ref in members if t == 'n']
+    way_refs = [ref for t, ref in members if t == 'w']
+    node_bounds = self._bounds('SELECT min(lat), min(lon), max(lat), max(lon) FROM nodes', node_refs)
+    way_bounds = self._bounds('SELECT min(s), min(w), max(n), max(e) FROM ways', way_refs)
+    bounds = self._merge_bounds(node_bounds, way_bounds)
+    if bounds == None:
+      return
+    self._add_element(relation_id, 'relation', bounds, tags)
+
+  def _is_included(self, tags, is_way):
+    # same selection as OverpassAPI.load_names_in_bounding_box
+    if 'name' in tags:
+      return not any(k in tags for k in Datastore.osm_exclusions)
+    return is_way and 'ref' in tags
+
+  def _add_element(self, element_id, type_name, bounds, tags):
+    (s, w, n, e) = bounds
+    (lat, lon) = ((s + n) / 2, (w + e) / 2)
+    (y, x) = Datastore.osm_tile(lat, lon)
+    # elements crossing tile borders are assigned when the tiles are built
+    large = Datastore.osm_tile(s, w) != Datastore.osm_tile(n, e)
+    names = [tags.get(k, '') for k in OverpassAPI.name_keys]
+    self.element_batch.append((y, x, element_id, type_name, lat, lon, *names, *bounds, large))
+
+  def _bounds(self, query, refs):
+    bounds = None
+    for i in range(0, len(refs), self.max_params):
+      batch = refs[i:i+self.max_params]
+      params = ','.join('?' * len(batch))
+      row = self.staging.execute(f'{query} WHERE id IN ({params})', batch).fetchone()
+      if row[0] != None:
+        bounds = self._merge_bounds(bounds, row)
+    return bounds
+
+  def _merge_bounds(self, a, b):
+    if a == None:
+      return b
+    if b == None:
+      return a
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+  def _flush(self):
+    self.staging.executemany('INSERT OR REPLACE INTO nodes VALUES (?, ?, ?)', self.node_batch)
+    self.staging.executemany('INSERT OR REPLACE INTO ways VALUES (?, ?, ?, ?, ?)', self.way_batch)
+    self.staging.executemany('INSERT INTO elements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', self.element_batch)
+    self.staging.commit()
+    self.node_batch = []
+    self.way_batch = []
+    self.element_batch = []
+
+  def _build_tiles(self):
+    self.staging.execute('CREATE INDEX elements_index ON elements(y, x, large)')
+    columns = 'id, type, lat, lon, name, name_en, alt_name, short_name, ref, s, w, n, e'
+    cursor = self.staging.execute(f'SELECT {columns} FROM elements WHERE large = 1')
+    large_rows = Datastore.assign_osm_rows(self._rows(cursor), self.tiles) if len(self.tiles) > 0 else {}
+    built = 0
+    row_count = 0
+    for tile in sorted(self.tiles):
+      if not self.overwrite and Datastore.osm_tile_cached(tile):
+        continue
+      cursor = self.staging.execute(f'SELECT {columns} FROM elements WHERE y = ? AND x = ? AND large = 0', tile)
+      rows = self._rows(cursor) + large_rows[tile]
+      row_count += Datastore.store_osm_tile(tile, rows)
+      built += 1
+
+    elapsed = time.time() - self.start_time
+    print(f'built {built} of {len(self.tiles)} tiles with {row_count} elements in {elapsed:.0f}s')
+    print('tiles on the border of the extract may be incomplete')
+
+  def _rows(self, cursor):
+    return [['' if v == None else v for v in r] for r in cursor]
+
+  def _read_xml(self, path):
+    f = bz2.open(path, 'rb') if path.endswith('.bz2') else open(path, 'rb')
+    with f:
+      context = etree.iterparse(f, events=('start', 'end'))
+      _, root = next(context)
+      for event, elem in context:
+        if event != 'end':
+          continue
+        if elem.tag == 'node':
+          tags = self._xml_tags(elem)
+          self.add_node(int(elem.get('id')), float(elem.get('lat')), float(elem.get('lon')), tags)
+        elif elem.tag == 'way':
+          node_refs = [int(nd.get('ref')) for nd in elem.iter('nd')]
+          self.add_way(int(elem.get('id')), node_refs, self._xml_tags(elem))
+        elif elem.tag == 'relation':
+          members = [(m.get('type')[0], int(m.get('ref'))) for m in elem.iter('member')]
+          self.add_relation(int(elem.get('id')), members, self._xml_tags(elem))
+        else:
+          continue
+        root.clear()
+
+  def _xml_tags(self, elem):
+    return {t.get('k'): t.get('v') for t in elem.iter('tag')}
+
+  def _read_pbf(self, path):
+    if osmium == None:
+      raise ImportError('reading PBF extracts requires pyosmium (pip install osmium)')
+
+    importer = self
+
+    class Handler(osmium.SimpleHandler):
+
+      def node(self, n):
+        if n.location.valid():
+          tags = {t.k: t.v for t in n.tags}
+          importer.add_node(n.id, n.location.lat, n.location.lon, tags)
+
+      def way(self, w):
+        tags = {t.k: t.v for t in w.tags}
+        importer.add_way(w.id, [nd.ref for nd in w.nodes], tags)
+
+      def relation(self, r):
+        tags = {t.k: t.v for t in r.tags}
+        importer.add_relation(r.id, [(m.type, m.ref) for m in r.members], tags)
+
+    Handler().apply_file(path)
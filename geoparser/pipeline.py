@@ -27,6 +27,7 @@ class Pipeline:
   def annotate(self, doc):
     for step in self.steps:
       step.annotate(doc)
+    Datastore.flush_geonames()
 
 
 class PipelineBuilder:
@@ -35,6 +36,8 @@ class PipelineBuilder:
   cogcomp_url = None
   stanford_url = None
   keep_defaults = False
+  local_matcher = 'names'
+  local_single_pass = False
 
   def build_empty(self):
     return Pipeline()
@@ -66,7 +69,7 @@ class PipelineBuilder:
 
   def build(self, ner_key):
     pipe = self.build_global(ner_key)
-    pipe.add(LocalGeoparser())
+    pipe.add(LocalGeoparser(self.local_matcher, self.local_single_pass))
     return pipe
 
   def build_wiki(self):
@@ -53,6 +53,10 @@ class GeoUtil:
   def point_in_bounding_box(lat, lon, bbox):
     return bbox.s < lat < bbox.n and bbox.w < lon < bbox.e
 
+  @staticmethod
+  def bounding_boxes_intersect(a, b):
+    return a.s <= b.n and a.n >= b.s and a.w <= b.e and a.e >= b.w
+
   @staticmethod
   def distance(lat1, lon1, lat2, lon2):
     p1 = GeoUtil.geojson_point(lat1, lon1)
@@ -0,0 +1,72 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .datastore import Datastore
+from .geonames import GeoNamesAPI
+
+
+class CacheWarmer:
+
+  def __init__(self, min_population=100000, country_codes=None, workers=4):
+    self.min_population = min_population
+    self.country_codes = country_codes
+    self.workers = workers
+
+  def warm_up(self):
+    cities = self.find_cities()
+    progress_path = Datastore._data_path('warm-cache-progress', 'txt', cache=True)
+    done = self._load_progress(progress_path)
+    todo = [c for c in cities if c.id not in done]
+    print(f'warming up {len(todo)} of {len(cities)} cities ({len(cities) - len(todo)} already done)')
+
+    start_time = time.time()
+    completed = 0
+    failed = 0
+    element_count = 0
+    with open(progress_path, 'a') as progress, ThreadPoolExecutor(self.workers) as executor:
+      futures = {executor.submit(self._warm_up_city, c): c for c in todo}
+      for future in as_completed(futures):
+        city = futures[future]
+        try:
+          count = future.result()
+        except Exception as e:
+          print(f'failed to warm up {city}: {e}')
+          count = None
+        if count == None:
+          failed += 1
+          continue
+        # only completed cities are skipped when resuming
+        progress.write(f'{city.id}\n')
+        progress.flush()
+        completed += 1
+        element_count += count
+        elapsed = time.time() - start_time
+        print(f'{completed + failed}/{len(todo)} {city.name}: {count} elements ' +
+              f'({completed / elapsed * 60:.1f} cities/min, {element_count / elapsed:.0f} elements/s)')
+
+    Datastore.flush_geonames()
+    elapsed = time.time() - start_time
+    print(f'warmed up {completed} cities with {element_count} elements in {elapsed:.0f}s, {failed} failed')
+
+  def find_cities(self):
+    db = Datastore._geonames_db()
+    if db.has_dump():
+      return db.get_dump_cities(self.min_population, self.country_codes)
+    cities = []
+    for country_code in self.country_codes or [None]:
+      cities += GeoNamesAPI.get_cities(self.min_population, country_code)
+    return sorted(cities, key=lambda g: -g.population)
+
+  def _warm_up_city(self, city):
+    # the tiles are only stored, not opened and indexed for matching
+    (tiles, complete) = Datastore.ensure_osm_tiles(city)
+    if not complete:
+      return None
+    # geometries are loaded together with the names
+    return Datastore.count_osm_elements(tiles)
+
+  def _load_progress(self, path):
+    if not os.path.exists(path):
+      return set()
+    with open(path, 'r') as f:
+      return set(int(line) for line in f if line.strip() != '')
@@ -0,0 +1,9 @@
+import sys
+from geoparser import GeoNamesDumpImporter
+
+# usage: python3 import-geonames-dump.py <dir with allCountries.txt, alternateNamesV2.txt, hierarchy.txt>
+
+dump_dir = sys.argv[1]
+
+importer = GeoNamesDumpImporter()
+importer.import_dump(dump_dir)
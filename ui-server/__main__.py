@@ -1,7 +1,8 @@
 import sys
 import os
+import json
 from flask import Flask, request
-from geoparser import Document, PipelineBuilder, NERException
+from geoparser import Document, Datastore, PipelineBuilder, NERException
 
 port = sys.argv[1]
 
@@ -54,6 +55,18 @@ def post_stanford():
 def post_gcnl():
   return process(gcnl_pipe)
 
+@app.route('/cache', methods=['GET'])
+def get_cache_stats():
+  return json.dumps(Datastore.cache_stats())
+
+@app.route('/cache', methods=['DELETE'])
+def clear_caches():
+  # the server listens on all interfaces, only clear the caches on local requests
+  if request.remote_addr not in ['127.0.0.1', '::1']:
+    return 'Forbidden', 403
+  Datastore.clear_caches()
+  return ''
+
 def process(pipe):
   req_text = request.get_data(as_text=True)
   doc = Document(text=req_text)
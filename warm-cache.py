@@ -0,0 +1,20 @@
+import sys
+from geoparser import CacheWarmer
+
+# usage: python3 warm-cache.py [--population <min>] [--countries <CC,CC,...>] [--workers <n>]
+# progress is kept in the cache directory, an interrupted run resumes where it stopped
+
+args = sys.argv[1:]
+
+def option(name, default):
+  if name in args:
+    return args[args.index(name) + 1]
+  return default
+
+min_population = int(option('--population', 100000))
+countries = option('--countries', None)
+country_codes = None if countries == None else countries.upper().split(',')
+workers = int(option('--workers', 4))
+
+warmer = CacheWarmer(min_population, country_codes, workers)
+warmer.warm_up()